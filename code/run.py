@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 import logging
 import os
+import signal
 import subprocess
 import sys
-from datetime import datetime
 from logging.handlers import TimedRotatingFileHandler
 from pathlib import Path
 
@@ -13,8 +13,11 @@ from dotenv import load_dotenv
 from aiogram import Dispatcher
 
 from support_bot import (
-    SupportBot, destruct_messages, register_handlers, stats_to_admin_chat, sweep_user_locks,
+    MAX_UPDATES_IN_FLIGHT, SupportBot, flush_db_buffers, log_update_load, prewarm_files,
+    register_handlers, reload_menus, resume_broadcasts, stats_to_admin_chat, sweep_user_locks,
 )
+from support_bot.supervisor import LOG_FORMAT as WORKER_LOG_FORMAT, supervise
+from support_bot.webhook import run_webhook_server, set_webhooks
 
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -22,12 +25,13 @@ BOTS = ()
 logger = logging.getLogger('support_bot')
 
 
-def setup_logger(level: int = logging.INFO, log_path: Path | None = None) -> None:
+def setup_logger(level: int = logging.INFO, log_path: Path | None = None,
+                 fmt: str = '%(asctime)s %(levelname)s: %(message)s') -> None:
     logger.setLevel(level)
 
     stream_handler = logging.StreamHandler()
     stream_handler.setLevel(level)
-    formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
+    formatter = logging.Formatter(fmt)
     stream_handler.setFormatter(formatter)
     logger.addHandler(stream_handler)
 
@@ -62,17 +66,69 @@ def init_bots() -> None:
             BOTS.append(SupportBot(name, logger))
 
 
+def make_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+    register_handlers(dp)
+    dp.shutdown.register(flush_db_buffers)
+    return dp
+
+
 async def start() -> None:
     """
     Create bot instances and run them within a dispatcher
     """
     await start_jobs(BOTS)
+    dp = make_dispatcher()
 
-    dp = Dispatcher()
-    register_handlers(dp)
+    for bot in BOTS:  # in case the bot was run in webhook mode before
+        await bot.delete_webhook()
 
     logger.info('Started bots: %s', ', '.join([b.name for b in BOTS]))
-    await dp.start_polling(*BOTS, polling_timeout=30)
+    await dp.start_polling(*BOTS, polling_timeout=30, tasks_concurrency_limit=MAX_UPDATES_IN_FLIGHT)
+
+
+async def start_webhook() -> None:
+    """
+    Run the bots receiving updates by webhooks, served by one aiohttp server
+    """
+    base_url = os.getenv('WEBHOOK_URL', '')
+    if not base_url.startswith('https://'):
+        logger.error('WEBHOOK_URL must be set to the HTTPS address of this server, got "%s"',
+                     base_url)
+        sys.exit(1)
+
+    await start_jobs(BOTS)
+    dp = make_dispatcher()
+
+    concurrency = int(os.getenv('WEBHOOK_CONCURRENCY', 100))
+    await set_webhooks(dp, BOTS, base_url, concurrency)
+
+    host, port = os.getenv('WEBHOOK_HOST', '0.0.0.0'), int(os.getenv('WEBHOOK_PORT', 8080))
+    logger.info('Started bots: %s, serving webhooks on %s:%s',
+                ', '.join([b.name for b in BOTS]), host, port)
+
+    task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    try:
+        await run_webhook_server(dp, BOTS, host, port, concurrency)
+    except asyncio.CancelledError:
+        logger.info('Webhook server stopped')
+
+
+async def start_supervisor() -> None:
+    """
+    Run the enabled bots sharded across WORKERS processes, each one
+    with its own dispatcher, jobs and DB engines
+    """
+    names = [name.strip() for name in os.getenv('BOTS_ENABLED').split(',') if name.strip()]
+    workers = int(os.getenv('WORKERS') or os.cpu_count())
+
+    task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    try:
+        await supervise(Path(__file__).resolve(), names, workers, logger)
+    except asyncio.CancelledError:
+        logger.info('Workers stopped')
 
 
 def cmd_makemigrations() -> None:
@@ -110,24 +166,40 @@ def cmd_migrate() -> None:
 async def start_jobs(bots: list[SupportBot]) -> None:
     scheduler = AsyncIOScheduler()
     scheduler.add_job(stats_to_admin_chat, 'cron', day_of_week=0, args=(bots,))  # weekly
-    scheduler.add_job(destruct_messages, 'interval', minutes=10, args=(bots,),
-                      next_run_time=datetime.now())  # on startup, then every 10 minutes
     scheduler.add_job(sweep_user_locks, 'interval', hours=1, args=(bots,))
+    scheduler.add_job(flush_db_buffers, 'interval', seconds=5, args=(bots,))
+    scheduler.add_job(reload_menus, 'interval', seconds=5, args=(bots,))
+    scheduler.add_job(log_update_load, 'interval', minutes=1, args=(bots,))
+    scheduler.add_job(prewarm_files, args=(bots,))  # once, right away
     scheduler.start()
 
+    for bot in bots:
+        bot.destructor.start()
+        bot.gsheets.start()
+    await resume_broadcasts(bots)
+
 
 def main() -> None:
-    setup_logger(log_path=BASE_DIR / '..' / 'shared' / 'support_bot.log')
+    if os.getenv('MBSB_WORKER'):  # logs are written by the supervisor
+        setup_logger(fmt=WORKER_LOG_FORMAT)
+    else:
+        setup_logger(log_path=BASE_DIR / '..' / 'shared' / 'support_bot.log')
 
     if not os.environ.get('IS_DOCKER', False):
         load_dotenv(BASE_DIR / '../.env')
 
+    if 'supervise' in sys.argv:
+        asyncio.run(start_supervisor())
+        return
+
     init_bots()
 
     if 'makemigrations' in sys.argv:
         cmd_makemigrations()
     elif 'migrate' in sys.argv:
         cmd_migrate()
+    elif 'webhook' in sys.argv:
+        asyncio.run(start_webhook())
     else:
         asyncio.run(start())
 
@@ -1,4 +1,7 @@
+from .admission import MAX_UPDATES_IN_FLIGHT, log_update_load
 from .bot import SupportBot
+from .broadcast import resume_broadcasts
+from .buttons import prewarm_files
 from .handlers import register_handlers
 from .informing import stats_to_admin_chat
-from .utils import destruct_messages, sweep_user_locks
+from .utils import flush_db_buffers, reload_menus, sweep_user_locks
@@ -3,14 +3,16 @@ from typing import Any
 
 import aiogram.types as agtypes
 from aiogram import Dispatcher
-from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.base import StorageKey
 
+from .broadcast import Broadcast
 from .const import AdminBtn, SendMode
 from .informing import handle_error, log
+from .ratelimit import bulk_lane
 from .utils import may_use_admin_actions
 
 
@@ -31,6 +33,8 @@ SETTINGS_LABELS = {
     'mirror_replies': 'Mirror replies',
     'mirror_reactions': 'Mirror reactions',
     'admin_only_actions': 'Admin actions for group admins only',
+    'antiflood_messages': 'Antiflood: max messages from a user',
+    'antiflood_window': 'Antiflood: per seconds',
 }
 
 # Brief explanation of how each reply mode routes admin messages to the user.
@@ -82,18 +86,19 @@ async def del_old_topics(call: agtypes.CallbackQuery) -> None:
     """
     msg = call.message
     bot, db = msg.bot, msg.bot.db
-    await msg.answer(bot.admin_menu[AdminBtn.DEL_OLD_TOPICS]['answer'])
+    await msg.answer(bot.admin_menu[AdminBtn.DEL_OLD_TOPICS].answer)
 
     i = 0
-    for tguser in await db.tguser.get_olds():
-        if tguser.thread_id:
-            try:
-                await bot.delete_forum_topic(bot.cfg.admin_group_id, tguser.thread_id)
-                i += 1
-            except TelegramBadRequest as exc:
-                await bot.log_error(exc)
+    with bulk_lane():
+        for tguser in await db.tguser.get_olds():
+            if tguser.thread_id:
+                try:
+                    await bot.delete_forum_topic(bot.cfg.admin_group_id, tguser.thread_id)
+                    i += 1
+                except TelegramBadRequest as exc:
+                    await bot.log_error(exc)
 
-            await db.tguser.del_thread_id(tguser.user_id)
+                await db.tguser.del_thread_id(tguser.user_id)
 
     emo = '😐' if i == 0 else '🫡'
     end = '' if i == 1 else 's'
@@ -107,7 +112,7 @@ async def toggle_ban(call: agtypes.CallbackQuery, cbd: CallbackData) -> None:
     Admin action - ban or unban the user of the current topic,
     and swap the button to the opposite action
     """
-    from .buttons import _get_kb_builder, build_ban_menu
+    from .buttons import ban_markup
 
     msg = call.message
     bot, db = msg.bot, msg.bot.db
@@ -119,9 +124,8 @@ async def toggle_ban(call: agtypes.CallbackQuery, cbd: CallbackData) -> None:
     banned = cbd.code == AdminBtn.BAN
     await db.tguser.update(tguser.user_id, banned=banned)
 
-    markup = _get_kb_builder(build_ban_menu(banned), cbd.msgid).as_markup()
-    await bot.edit_message_reply_markup(chat_id=msg.chat.id, message_id=cbd.msgid,
-                                        reply_markup=markup)
+    await bot.edit_message_reply_markup(chat_id=msg.chat.id, message_id=msg.message_id,
+                                        reply_markup=ban_markup(banned))
 
     text = 'User banned 🚫' if banned else 'User unbanned ♻️'
     await bot.send_message(msg.chat.id, text, message_thread_id=msg.message_thread_id)
@@ -142,7 +146,7 @@ async def admin_broadcast_start(call: agtypes.CallbackQuery, dispatcher: Dispatc
     state = FSMContext(dispatcher.storage, key)
 
     await state.set_state(BroadcastForm.message)
-    await send_new_msg_with_keyboard(bot, msg.chat.id, bot.admin_menu[AdminBtn.BROADCAST]['answer'],
+    await send_new_msg_with_keyboard(bot, msg.chat.id, bot.admin_menu[AdminBtn.BROADCAST].answer,
                                      build_cancel_menu())
 
 
@@ -189,7 +193,8 @@ async def admin_broadcast_ask_confirm(msg: agtypes.Message, state: FSMContext,
 async def admin_broadcast_finish(call: agtypes.CallbackQuery, state: FSMContext,
                                  *args, **kwargs) -> None:
     """
-    End of the broadcasting flow - send the message or forget it
+    End of the broadcasting flow - start sending the message in the background,
+    or forget it
     """
     from .buttons import CBD
 
@@ -203,45 +208,14 @@ async def admin_broadcast_finish(call: agtypes.CallbackQuery, state: FSMContext,
 
     if cbd.code == 'yes':
         text = 'Broadcasting the message...'
-        await bot.edit_message_text(chat_id=msg.chat.id, message_id=cbd.msgid, text=text)
-
-        success_count = 0
-        forbidden_count = 0
-        users = [user for user in await bot.db.tguser.get_all() if not user.banned]
-        for i, user in enumerate(users):
-            while True:
-                try:
-                    await bot.copy_message(user.user_id, from_chat_id=msg.chat.id,
-                                           message_id=state_data['message'])
-                    success_count += 1
-                    break
-                except TelegramRetryAfter as exc:
-                    await bot.log(f'Throttled by Telegram, sleeping {exc.retry_after}s')
-                    await asyncio.sleep(exc.retry_after)
-                except TelegramForbiddenError:
-                    forbidden_count += 1
-                    break
-                except Exception as exc:
-                    await bot.log_error(exc, traceback=False)
-                    break
-
-            await asyncio.sleep(0.05)  # ~20 msgs/sec, under Telegram's ~30/sec global cap
-
-            if len(users) > 50 and i != 0 and i % (len(users) // 10) == 0:
-                await bot.log(f'{i}/{len(users)} processed for broadcasting')
-
-        res_str = f'{success_count}/{len(users)}'
-        await bot.log(f'Broadcasting is done: {res_str}')
-
-        report = f'Broadcasting is done 🫡. {res_str} users received the message.'
-        if forbidden_count:
-            postfix = 's' if forbidden_count > 1 else ''
-            report += f' Messages to {forbidden_count} user{postfix} were forbidden by Telegram.'
-        await msg.answer(report)
+        await bot.edit_message_text(chat_id=msg.chat.id, message_id=msg.message_id, text=text)
+        broadcast = await Broadcast.create(bot, msg.chat.id, state_data['message'],
+                                           progress_msg_id=msg.message_id)
+        broadcast.start()
 
     elif cbd.code == 'no':
         text = 'Broadcasting canceled'
-        await bot.edit_message_text(chat_id=msg.chat.id, message_id=cbd.msgid, text=text)
+        await bot.edit_message_text(chat_id=msg.chat.id, message_id=msg.message_id, text=text)
 
     await state.clear()
     return await call.answer()
@@ -0,0 +1,115 @@
+"""
+Limiting how many updates a bot handles at once
+"""
+import asyncio
+from collections import Counter
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+if TYPE_CHECKING:
+    from .bot import SupportBot
+
+
+MAX_UPDATES_IN_FLIGHT = 64  # per bot, updates beyond it are not fetched from Telegram
+# updates of a type handled at once by a bot, and waiting for a slot. They add up
+# to MAX_UPDATES_IN_FLIGHT, so a type never holds the slots of the others
+TYPE_LIMITS = {
+    'message': (30, 14),
+    'callback_query': (8, 4),
+    'edited_message': (2, 2),
+    'message_reaction': (2, 1),
+    'my_chat_member': (1, 0),
+}
+
+
+class UpdateAdmission:
+    """
+    Admits a bot's updates to the handlers by per-type semaphores, and counts
+    updates in flight, waiting and shed for each type, with peaks between reports.
+    The bot's total limit is the dispatcher's `tasks_concurrency_limit` (or
+    the webhook server's concurrency, also per bot): an update waiting here
+    holds one of its slots, so under load the bot stops fetching updates
+    instead of piling up tasks. The waiting updates of a type are bounded too,
+    and updates beyond are shed, so a flood of one type can't take the slots
+    of the others.
+    """
+    def __init__(self):
+        self._semaphores = {typ: asyncio.Semaphore(limit)
+                            for typ, (limit, _) in TYPE_LIMITS.items()}
+        self.in_flight: Counter[str] = Counter()
+        self.waiting: Counter[str] = Counter()
+        self.peak_in_flight: Counter[str] = Counter()
+        self.peak_waiting: Counter[str] = Counter()
+        self.shed: Counter[str] = Counter()
+
+    @asynccontextmanager
+    async def admit(self, typ: str) -> AsyncIterator[bool]:
+        """
+        Yield whether the update is admitted, False if it's shed
+        """
+        if (semaphore := self._semaphores.get(typ)) is not None:
+            if not semaphore.locked():
+                await semaphore.acquire()  # right away
+            elif self.waiting[typ] >= TYPE_LIMITS[typ][1]:
+                self.shed[typ] += 1
+                yield False
+                return
+            else:
+                self.waiting[typ] += 1
+                self.peak_waiting[typ] = max(self.peak_waiting[typ], self.waiting[typ])
+                try:
+                    await semaphore.acquire()
+                finally:
+                    self.waiting[typ] -= 1
+
+        self.in_flight[typ] += 1
+        self.peak_in_flight[typ] = max(self.peak_in_flight[typ], self.in_flight[typ])
+        try:
+            yield True
+        finally:
+            self.in_flight[typ] -= 1
+            if semaphore is not None:
+                semaphore.release()
+
+    def take_report(self) -> str | None:
+        """
+        Peaks of updates in flight and waiting, and updates shed,
+        since the last report, if any
+        """
+        if not self.peak_in_flight and not self.shed:
+            return None
+        report = ', '.join(
+            f'{typ} {self.peak_in_flight[typ]} in flight, {self.peak_waiting[typ]} waiting'
+            + (f', {self.shed[typ]} shed' if self.shed[typ] else '')
+            for typ in (self.peak_in_flight | self.shed)
+        )
+        self.peak_in_flight = +self.in_flight  # drops zero counts
+        self.peak_waiting = +self.waiting
+        self.shed = Counter()
+        return report
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """
+    Outer update middleware passing updates to the handlers through
+    the bot's UpdateAdmission, and dropping the ones it sheds
+    """
+    async def __call__(self, handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: dict[str, Any]) -> Any:
+        async with data['bot'].admission.admit(event.event_type) as admitted:
+            if admitted:
+                return await handler(event, data)
+            return None
+
+
+async def log_update_load(bots: list['SupportBot']) -> None:
+    """
+    Log the peaks of updates handled by each bot, if it had any
+    """
+    for bot in bots:
+        if report := bot.admission.take_report():
+            await bot.log(f'Updates: {report}')
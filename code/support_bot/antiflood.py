@@ -0,0 +1,100 @@
+"""
+Limiting how many messages a user can send to the bot
+"""
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING, Any
+
+import aiogram.types as agtypes
+from aiogram import BaseMiddleware
+from aiogram.enums.chat_type import ChatType
+
+from .ratelimit import bulk_lane
+
+if TYPE_CHECKING:
+    from .bot import SupportBot
+
+
+NOTICE_DELAY = 10  # seconds of suppressed messages coalesced into one notice in the topic
+
+
+class FloodGuard:
+    """
+    Allows each user `antiflood_messages` messages per `antiflood_window`
+    seconds, by a sliding window: the times of the user's last allowed
+    messages are kept in a deque of that length. Users who haven't sent
+    anything for a window are forgotten.
+    Suppressed messages are counted per user, and reported in the user's
+    topic with one notice per NOTICE_DELAY, if the bot is set up to do so.
+    """
+    def __init__(self, bot: 'SupportBot'):
+        self.bot = bot
+        self._sent: dict[int, deque[float]] = {}
+        self._suppressed: dict[int, int] = {}
+        self._swept = time.monotonic()
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.bot.cfg.antiflood_messages is not None
+
+    def allow(self, user_id: int) -> bool:
+        limit, window = self.bot.cfg.antiflood_messages, self.bot.cfg.antiflood_window
+        now = time.monotonic()
+        if now - self._swept >= window:
+            self._sweep(now - window)
+
+        if (sent := self._sent.get(user_id)) is None:
+            sent = self._sent[user_id] = deque(maxlen=limit)
+        if len(sent) == limit and now - sent[0] < window:
+            self._suppress(user_id)
+            return False
+        sent.append(now)
+        return True
+
+    def _sweep(self, before: float) -> None:
+        self._sent = {uid: sent for uid, sent in self._sent.items() if sent[-1] >= before}
+        self._swept = time.monotonic()
+
+    def _suppress(self, user_id: int) -> None:
+        count = self._suppressed.get(user_id, 0)
+        self._suppressed[user_id] = count + 1
+        if count == 0:
+            task = asyncio.create_task(self._notify(user_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _notify(self, user_id: int) -> None:
+        await asyncio.sleep(NOTICE_DELAY)
+        count = self._suppressed.pop(user_id, 0)
+        bot = self.bot
+        try:
+            await bot.log(f'Messages suppressed by antiflood from user {user_id}: {count}')
+            if not bot.cfg.antiflood_notify:
+                return
+            tguser = await bot.db.tguser.get(user_id=user_id)
+            if tguser and tguser.thread_id and not tguser.banned:
+                end = '' if count == 1 else 's'
+                with bulk_lane():
+                    await bot.send_message(
+                        bot.cfg.admin_group_id, message_thread_id=tguser.thread_id,
+                        text=f'🌊 {count} message{end} from the user suppressed by antiflood',
+                    )
+        except Exception as exc:
+            await bot.log_error(exc)
+
+
+class AntifloodMiddleware(BaseMiddleware):
+    """
+    Outer update middleware dropping users' private messages beyond
+    the bot's antiflood limit, before they are admitted to any handler
+    """
+    async def __call__(self, handler: Callable[[agtypes.Update, dict[str, Any]], Awaitable[Any]],
+                       event: agtypes.Update, data: dict[str, Any]) -> Any:
+        guard, msg = data['bot'].antiflood, event.message
+        if (guard.enabled and msg and msg.chat.type == ChatType.PRIVATE
+                and not guard.allow(msg.chat.id)):
+            return None
+        return await handler(event, data)
@@ -0,0 +1,139 @@
+"""
+Local archive of messages with full-text search, in a per-bot SQLite FTS5 index
+"""
+import asyncio
+import html
+from typing import TYPE_CHECKING
+
+import aiogram.types as agtypes
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from .const import MsgType
+from .utils import BufferedFlusher, determine_msg_type, make_short_user_info
+
+if TYPE_CHECKING:
+    from .bot import SupportBot
+
+
+BATCH_SIZE = 100  # the buffer is written when it has this many rows...
+FLUSH_DELAY = 1  # ...or this many seconds after the first buffered row
+SEARCH_LIMIT = 10  # results shown by the search command
+SNIPPET_TOKENS = 16  # words around the matches in a result
+MATCH_START, MATCH_END = '\x02', '\x03'  # snippet markers, replaced with tags after escaping
+
+CREATE_TABLE = sa.text(
+    'CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5('
+    'text, who, to_whom, filename, subject, '
+    'sent_at UNINDEXED, type UNINDEXED, thread_id UNINDEXED, '
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+INSERT = sa.text(
+    'INSERT INTO messages (text, who, to_whom, filename, subject, sent_at, type, thread_id) '
+    'VALUES (:text, :who, :to_whom, :filename, :subject, :sent_at, :type, :thread_id)'
+)
+SEARCH = sa.text(
+    f"SELECT snippet(messages, 0, '{MATCH_START}', '{MATCH_END}', '…', {SNIPPET_TOKENS}) "
+    'AS snippet, who, to_whom, sent_at, type, thread_id '
+    'FROM messages WHERE messages MATCH :query ORDER BY rank LIMIT :limit'
+)
+
+
+def _to_fts_query(text: str) -> str:
+    """
+    Make an FTS5 query of user input: every word must be found,
+    as is, so FTS5 syntax characters don't break the query
+    """
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+class MessageArchive:
+    """
+    Saves the bot's messages to `archive.sqlite` in the bot dir, and searches
+    them ranked by relevance. Rows are buffered in memory and inserted
+    in batches in the background; `flush` writes the buffer right away.
+    """
+    def __init__(self, bot: 'SupportBot'):
+        self.bot = bot
+        self.engine = create_async_engine(f'sqlite+aiosqlite:///{bot.botdir}/archive.sqlite')
+        self._table_created = False
+        self._buffer: list[dict] = []
+        self._flush_lock = asyncio.Lock()
+        self._flusher = BufferedFlusher(self.flush, bot.log_error, BATCH_SIZE, FLUSH_DELAY)
+
+    @property
+    def enabled(self) -> bool:
+        return self.bot.cfg.save_messages_archive
+
+    def add(self, msg: agtypes.Message, to_whom: str, subject: str | None,
+            thread_id: int | None) -> None:
+        typ = determine_msg_type(msg)
+        filename = ''
+        if typ in (MsgType.DOCUMENT, MsgType.AUDIO, MsgType.VIDEO):
+            filename = getattr(msg, typ).file_name or ''
+
+        self._buffer.append({
+            'text': msg.poll.question if typ == MsgType.POLL else (msg.text or msg.caption or ''),
+            'who': make_short_user_info(msg.from_user, escape=False),
+            'to_whom': to_whom,
+            'filename': filename,
+            'subject': subject or '',
+            'sent_at': msg.date.strftime('%Y-%m-%d %H:%M'),
+            'type': typ,
+            'thread_id': thread_id,
+        })
+
+        self._flusher.added(len(self._buffer))
+
+    async def _ensure_table(self, conn) -> None:
+        if not self._table_created:
+            await conn.execute(CREATE_TABLE)
+            self._table_created = True
+
+    async def flush(self) -> None:
+        """
+        Insert the buffered rows with one executemany
+        """
+        async with self._flush_lock:
+            self._flusher.cancel_timer()
+            if not self._buffer:
+                return
+            rows, self._buffer = self._buffer, []
+
+            try:
+                async with self.engine.begin() as conn:
+                    await self._ensure_table(conn)
+                    await conn.execute(INSERT, rows)
+            except Exception:
+                self._buffer[:0] = rows
+                raise
+
+    async def search(self, text: str, limit: int = SEARCH_LIMIT) -> list[sa.Row]:
+        """
+        The most relevant messages containing all the words of the text
+        """
+        await self.flush()
+        async with self.engine.begin() as conn:
+            await self._ensure_table(conn)
+            result = await conn.execute(SEARCH, {'query': _to_fts_query(text), 'limit': limit})
+            return result.fetchall()
+
+
+def format_search_results(bot: 'SupportBot', text: str, rows: list[sa.Row]) -> str:
+    """
+    Text of a search command reply, with links to the user topics
+    """
+    if not rows:
+        return f'Nothing found for "{html.escape(text)}"'
+
+    group = str(bot.cfg.admin_group_id).removeprefix('-100')
+    results = [f'🔎 <b>{len(rows)}</b> most relevant messages for "{html.escape(text)}":']
+    for row in rows:
+        snippet = html.escape(row.snippet or f'[{row.type}]')
+        snippet = snippet.replace(MATCH_START, '<b>').replace(MATCH_END, '</b>')
+        header = html.escape(f'{row.sent_at}, {row.who} → {row.to_whom}')
+        if row.thread_id:
+            header = f'<a href="https://t.me/c/{group}/{row.thread_id}">{header}</a>'
+        results.append(f'{header}\n{snippet}')
+
+    return '\n\n'.join(results)
@@ -1,17 +1,23 @@
 import asyncio
 import logging
 import os
+import time
 from pathlib import Path
 
 from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from google.oauth2.service_account import Credentials
 
-from .buttons import load_toml
+from .admission import UpdateAdmission
+from .antiflood import FloodGuard
+from .archive import MessageArchive
 from .config import BotConfig
 from .const import AdminBtn
 from .db import SqlDb
+from .destruction import DestructionScheduler
+from .gsheets import GsheetsWriter
+from .menu import Menu, load_toml
+from .ratelimit import OutboundScheduler
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -23,8 +29,11 @@ class SupportBot(Bot):
     """
     cfg: BotConfig
     db: SqlDb
-    menu: dict | None
-    admin_menu: dict
+    menu: Menu | None
+    admin_menu: Menu
+    destructor: DestructionScheduler
+    gsheets: GsheetsWriter
+    archive: MessageArchive
 
     def __init__(self, name: str, logger: logging.Logger):
         self.name = name
@@ -35,8 +44,14 @@ class SupportBot(Bot):
         token, self.cfg = self._read_config()
         self._configure_db()
         self._load_menu()
+        self.destructor = DestructionScheduler(self)
+        self.gsheets = GsheetsWriter(self)
+        self.archive = MessageArchive(self)
+        self.admission = UpdateAdmission()
+        self.antiflood = FloodGuard(self)
 
         super().__init__(token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        self.session.middleware(OutboundScheduler())
 
     def user_lock(self, user_id: int) -> asyncio.Lock:
         """
@@ -87,25 +102,47 @@ class SupportBot(Bot):
     async def log_error(self, exception: Exception, traceback: bool = True) -> None:
         self._logger.error(f'{self.name}: {exception}', exc_info=traceback)
 
-    def get_gsheets_creds(self) -> Credentials:
+    @property
+    def menu_path(self) -> Path:
+        return self.botdir / 'menu.toml'
+
+    def _menu_file_stamp(self) -> tuple[float, int] | None:
+        try:
+            stat = self.menu_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def _compile_menu(self) -> Menu | None:
+        content = load_toml(self.menu_path)
+        return Menu(content, answer=self.cfg.hello_msg, numbered=True) if content else None
+
+    async def reload_menu(self) -> None:
         """
-        A callback to work with Google Sheets through gspread_asyncio.
+        Compile menu.toml again if it has changed since the last load, in a thread,
+        and swap the new menu in. If the file is invalid, the current menu is kept.
         """
-        cred_file = self.cfg.save_messages_gsheets_cred_file
-        creds = Credentials.from_service_account_file(cred_file)
-        scoped = creds.with_scopes([
-            "https://spreadsheets.google.com/feeds",
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive",
-        ])
-        return scoped
+        stamp = self._menu_file_stamp()
+        if stamp == self._menu_stamp:
+            return
+        self._menu_stamp = stamp
+
+        started = time.monotonic()
+        try:
+            menu = await asyncio.to_thread(self._compile_menu)
+        except Exception as exc:
+            await self.log(f'Keeping the current menu, menu.toml is invalid: {exc}',
+                           logging.ERROR)
+            return
+
+        self.menu = menu
+        await self.log(f'Menu reloaded in {(time.monotonic() - started) * 1000:.0f} ms')
 
     def _load_menu(self) -> None:
-        self.menu = load_toml(self.botdir / 'menu.toml')
-        if self.menu:
-            self.menu['answer'] = self.cfg.hello_msg
+        self._menu_stamp = self._menu_file_stamp()
+        self.menu = self._compile_menu()
 
-        self.admin_menu = {
+        self.admin_menu = Menu({
             AdminBtn.BROADCAST: {
                 'label': '📢 Broadcast to all subscribers',
                 'answer': "Send here a message to broadcast, and then I'll ask for confirmation",
@@ -117,4 +154,4 @@ class SupportBot(Bot):
             AdminBtn.SETTINGS: {
                 'label': '⚙️ Show settings',
             },
-        }
+        })
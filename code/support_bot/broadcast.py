@@ -0,0 +1,259 @@
+"""
+Broadcasting a message to all the bot users in the background
+"""
+import asyncio
+import datetime
+import html
+import time
+from collections import deque
+from typing import TYPE_CHECKING
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from sqlalchemy.engine.row import Row as SaRow
+
+from .ratelimit import TokenBucket, bulk_lane
+
+if TYPE_CHECKING:
+    from .bot import SupportBot
+
+
+MAX_RATE = 25  # messages per second, under Telegram's ~30/sec global cap
+MIN_RATE = 1
+SENDERS = 10  # concurrent copy_message calls
+PROGRESS_INTERVAL = 5  # seconds between edits of the progress message
+PAGE_SIZE = 500  # users read from the DB at once
+CHECKPOINT_EVERY = 50  # users sent between saving the progress to the DB...
+CHECKPOINT_INTERVAL = 5  # ...or seconds, whichever comes first
+ERROR_LENGTH = 1000  # characters of the error saved for a failed broadcast
+
+RUNNING: set[asyncio.Task] = set()  # strong refs, so running broadcasts aren't garbage collected
+
+
+class Broadcast:
+    """
+    Copies a message to every not banned and reachable user with a pool of
+    concurrent senders, sharing a token bucket. The rate is halved and the
+    senders paused on each RetryAfter, and then grows back by one message/sec
+    per second of sending without being throttled. Progress is shown by
+    editing `progress_msg_id`. Users who blocked the bot are marked unreachable,
+    and skipped by the next broadcasts.
+
+    Users are read in user_id order, and the progress is saved to the DB as
+    `last_user_id`: the user_id up to which every user has been processed.
+    A broadcast interrupted by a restart resumes from there. A graceful
+    shutdown saves the progress, but after a crash the users processed since
+    the last checkpoint (up to CHECKPOINT_EVERY of them, or CHECKPOINT_INTERVAL
+    seconds of sending) and the ones in flight get the message twice.
+    A broadcast stopped by an unexpected error is marked finished with
+    the error, and reported to the admin group instead of being resumed.
+    """
+    def __init__(self, bot: 'SupportBot', row: SaRow):
+        self.bot = bot
+        self.id = row.id
+        self.chat_id = row.chat_id  # the admin group, where the message and progress are
+        self.message_id = row.message_id
+        self.progress_msg_id = row.progress_msg_id
+        self.last_user_id = row.last_user_id
+
+        self.bucket = TokenBucket(MAX_RATE)
+        self.total = 0
+        self.success = row.success
+        self.forbidden = row.forbidden
+        self.failed = row.failed
+        self._sent_since_throttled = 0
+
+        self._in_flight: deque[int] = deque()  # user ids given to senders, ascending
+        self._done: set[int] = set()  # processed user ids, not counted in last_user_id yet
+        self._since_checkpoint = 0
+        self._checkpointed_at = time.monotonic()
+        self._checkpoint_lock = asyncio.Lock()
+        self._unreachable: list[int] = []  # blocked the bot, to be saved on the next checkpoint
+
+    @classmethod
+    async def create(cls, bot: 'SupportBot', chat_id: int, message_id: int,
+                     progress_msg_id: int) -> 'Broadcast':
+        row = await bot.db.broadcast.add(chat_id, message_id, progress_msg_id)
+        return cls(bot, row)
+
+    @property
+    def processed(self) -> int:
+        return self.success + self.forbidden + self.failed
+
+    def start(self) -> asyncio.Task:
+        with bulk_lane():
+            task = asyncio.create_task(self.run())
+        RUNNING.add(task)
+        task.add_done_callback(RUNNING.discard)
+        return task
+
+    async def run(self) -> None:
+        bot = self.bot
+        try:
+            self.total = self.processed + await bot.db.tguser.count_recipients(self.last_user_id)
+
+            queue = asyncio.Queue(maxsize=SENDERS * 2)
+            progress = asyncio.create_task(self._report_progress())
+            try:
+                await asyncio.gather(self._produce(queue),
+                                     *(self._sender(queue) for _ in range(SENDERS)))
+            finally:
+                progress.cancel()
+
+            await self._finish()
+        except asyncio.CancelledError:  # shutdown, resume on the next start
+            await self._checkpoint()
+            raise
+        except Exception as exc:
+            await bot.log_error(exc)
+            await self._fail(exc)
+
+    async def _produce(self, queue: asyncio.Queue) -> None:
+        """
+        Page through users after last_user_id and feed them to the senders
+        """
+        async for user_id in self.bot.db.tguser.iter_recipients(self.last_user_id, PAGE_SIZE):
+            self._in_flight.append(user_id)
+            await queue.put(user_id)
+
+        for _ in range(SENDERS):
+            await queue.put(None)  # stop the senders
+
+    async def _sender(self, queue: asyncio.Queue) -> None:
+        while (user_id := await queue.get()) is not None:
+            await self._send(user_id)
+            await self._ack(user_id)
+
+    async def _ack(self, user_id: int) -> None:
+        """
+        Mark the user processed and move last_user_id as far as possible
+        """
+        self._done.add(user_id)
+        while self._in_flight and self._in_flight[0] in self._done:
+            self.last_user_id = self._in_flight.popleft()
+            self._done.discard(self.last_user_id)
+
+        self._since_checkpoint += 1
+        if (self._since_checkpoint >= CHECKPOINT_EVERY
+                or time.monotonic() - self._checkpointed_at >= CHECKPOINT_INTERVAL):
+            try:
+                await self._checkpoint()
+            except Exception as exc:  # keep sending, the next checkpoint may succeed
+                await self.bot.log_error(exc)
+
+    async def _checkpoint(self, **kwargs) -> None:
+        async with self._checkpoint_lock:
+            self._since_checkpoint = 0
+            self._checkpointed_at = time.monotonic()
+
+            unreachable, self._unreachable = self._unreachable, []
+            try:
+                await self.bot.db.tguser.set_reachable(unreachable, False)
+            except Exception:
+                self._unreachable += unreachable
+                raise
+
+            await self.bot.db.broadcast.update(
+                self.id, last_user_id=self.last_user_id, success=self.success,
+                forbidden=self.forbidden, failed=self.failed, **kwargs,
+            )
+
+    async def _send(self, user_id: int) -> None:
+        bot = self.bot
+        while True:
+            await self.bucket.acquire()
+            try:
+                await bot.copy_message(user_id, from_chat_id=self.chat_id,
+                                       message_id=self.message_id)
+                self.success += 1
+                self._speed_up()
+                return
+            except TelegramRetryAfter as exc:
+                await self._slow_down(exc.retry_after)
+            except TelegramForbiddenError:
+                self.forbidden += 1
+                self._unreachable.append(user_id)
+                return
+            except Exception as exc:
+                self.failed += 1
+                await bot.log_error(exc, traceback=False)
+                return
+
+    def _speed_up(self) -> None:
+        self._sent_since_throttled += 1
+        if self._sent_since_throttled >= self.bucket.rate and self.bucket.rate < MAX_RATE:
+            self.bucket.rate = min(MAX_RATE, self.bucket.rate + 1)
+            self._sent_since_throttled = 0
+
+    async def _slow_down(self, retry_after: int) -> None:
+        self.bucket.rate = max(MIN_RATE, self.bucket.rate / 2)
+        self.bucket.pause(retry_after)
+        self._sent_since_throttled = 0
+        await self.bot.log(f'Throttled by Telegram, sleeping {retry_after}s, '
+                           f'then broadcasting at {self.bucket.rate:.1f} msgs/sec')
+
+    async def _report_progress(self) -> None:
+        last_text = ''
+        last_logged = time.monotonic()
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            text = (f'Broadcasting the message... {self.processed}/{self.total} processed, '
+                    f'{self.success} received')
+            if text != last_text:
+                await self._edit_progress(text)
+                last_text = text
+            if time.monotonic() - last_logged >= 60:
+                await self.bot.log(f'{self.processed}/{self.total} processed for broadcasting')
+                last_logged = time.monotonic()
+
+    async def _edit_progress(self, text: str) -> None:
+        try:
+            await self.bot.edit_message_text(chat_id=self.chat_id,
+                                             message_id=self.progress_msg_id, text=text)
+        except TelegramBadRequest as exc:
+            if 'not modified' not in exc.message.lower():
+                await self.bot.log_error(exc, traceback=False)
+
+    async def _finish(self) -> None:
+        await self._checkpoint(finished_at=datetime.datetime.utcnow())
+
+        res_str = f'{self.success}/{self.total}'
+        await self.bot.log(f'Broadcasting is done: {res_str}')
+
+        report = f'Broadcasting is done 🫡. {res_str} users received the message.'
+        if self.forbidden:
+            postfix = 's' if self.forbidden > 1 else ''
+            report += f' Messages to {self.forbidden} user{postfix} were forbidden by Telegram.'
+
+        await self._edit_progress(report)
+        await self.bot.send_message(self.chat_id, report)
+
+    async def _fail(self, exc: Exception) -> None:
+        """
+        Stop the broadcast for good, and tell the admins why
+        """
+        try:
+            await self._checkpoint(finished_at=datetime.datetime.utcnow(),
+                                   error=str(exc)[:ERROR_LENGTH])
+        except Exception as checkpoint_exc:  # left unfinished, resumed on the next start
+            await self.bot.log_error(checkpoint_exc)
+
+        report = (f'Broadcasting failed 😞 {self.success}/{self.total} users received '
+                  f'the message. Error: {html.escape(str(exc)[:ERROR_LENGTH])}')
+        try:
+            await self._edit_progress(report)
+            await self.bot.send_message(self.chat_id, report)
+        except Exception as report_exc:
+            await self.bot.log_error(report_exc)
+
+
+async def resume_broadcasts(bots: list['SupportBot']) -> None:
+    """
+    Continue the broadcasts interrupted by a restart
+    """
+    for bot in bots:
+        try:
+            for row in await bot.db.broadcast.get_unfinished():
+                await bot.log(f'Resuming broadcast {row.id} after user {row.last_user_id}')
+                Broadcast(bot, row).start()
+        except Exception as exc:
+            await bot.log_error(exc)
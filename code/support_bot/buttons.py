@@ -2,19 +2,19 @@
 Display menu with buttons according to menu.toml file,
 handle buttons actions
 """
-from pathlib import Path
+import functools
 from typing import TYPE_CHECKING
 
 import aiogram.types as agtypes
-import toml
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters.callback_data import CallbackData
-from aiogram.types import InlineKeyboardButton
-from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 from .admin_actions import admin_broadcast_start, bot_settings, del_old_topics, toggle_ban
-from .const import MSG_TEXT_LIMIT, AdminBtn, ButtonMode, MenuMode
+from .const import AdminBtn, ButtonMode, MenuMode
 from .informing import handle_error, log
+from .menu import Menu, MenuNode
+from .ratelimit import bulk_lane
 from .utils import may_use_admin_actions, save_for_destruction
 
 
@@ -22,133 +22,78 @@ if TYPE_CHECKING:
     from .bot import SupportBot
 
 
-def load_toml(path: Path) -> dict | None:
-    """
-    Read toml file
-    """
-    if path.is_file():
-        with open(path) as f:
-            menu = toml.load(f)
-        _validate_menu_modes(menu)
-        return menu
-
-
-def _validate_menu_modes(menu: dict) -> None:
-    """
-    Recursively check any 'menumode' entries against MenuMode at startup,
-    so typos like menumode = "rows" fail loudly instead of silently falling
-    back to the default layout.
-    """
-    for key, val in menu.items():
-        if key == 'menumode':
-            MenuMode.validate(val, raise_exc=True)
-        elif isinstance(val, dict):
-            _validate_menu_modes(val)
+MARKUP_CACHE_SIZE = 1024  # keyboards of menu nodes kept built
 
 
 class CBD(CallbackData, prefix='_'):
     """
-    Callback Data
+    Callback Data of admin keyboards (and of user menus sent before their nodes
+    were numbered). The message with the button is known from the callback query.
     """
     path: str  # separated inside by '.'
     code: str  # button identifier after the path
-    msgid: int  # id of a message with this button
+
+    @classmethod
+    def unpack(cls, value: str) -> 'CBD':
+        """
+        Also accept buttons sent before, which ended with their message id
+        """
+        if value.count(cls.__separator__) > len(cls.model_fields):
+            value = value.rsplit(cls.__separator__, 1)[0]
+        return super().unpack(value)
 
 
-class Button:
+class NodeCBD(CallbackData, prefix='n'):
     """
-    Wrapper over an inline keyboard button
+    Compact callback data of a numbered menu's button, of any depth
     """
-    def __init__(self, content: dict):
-        self.content = content
-        self._recognize_mode()
+    num: int  # MenuNode.num
 
-        empty_answer_allowed = self.mode in (ButtonMode.LINK, ButtonMode.FILE)
-        self.answer = _extract_answer(content, empty=empty_answer_allowed)
 
-    def _recognize_mode(self) -> None:
-        self.mode = ButtonMode.ANSWER  # label-only buttons act on press via their handler
-        if 'link' in self.content:
-            self.mode = ButtonMode.LINK
-        elif 'file' in self.content:
-            self.mode = ButtonMode.FILE
-        elif any([isinstance(v, dict) and 'label' in v for v in self.content.values()]):
-            self.mode = ButtonMode.MENU
-        elif 'subject' in self.content:
-            self.mode = ButtonMode.SUBJECT
-        elif 'answer' in self.content:
-            self.mode = ButtonMode.ANSWER
-
-    def as_inline(self, callback_data: str | None = None) -> InlineKeyboardButton:
-        if self.mode in (ButtonMode.FILE, ButtonMode.ANSWER, ButtonMode.MENU, ButtonMode.SUBJECT):
-            return InlineKeyboardButton(text=self.content['label'], callback_data=callback_data)
-        elif self.mode == ButtonMode.LINK:
-            return InlineKeyboardButton(text=self.content['label'], url=self.content['link'])
-        raise ValueError('Unexpected button mode')
-
-
-def _extract_answer(menu: dict, empty: bool=False) -> str:
-    answer = (menu.get('answer') or '')[:MSG_TEXT_LIMIT]
-    if not empty:
-        answer = answer or '👀'
-    return answer
-
-
-def _create_button(content: dict) -> Button | None:
+def _pack(target: MenuNode) -> str:
     """
-    Button factory
+    Callback data of a button which opens the target node
     """
-    if 'label' in content:
-        return Button(content)
+    if target.num is not None:
+        return NodeCBD(num=target.num).pack()
+    return CBD(path=target.path, code=target.key).pack()
 
 
-def _get_kb_builder(menu: dict, msgid: int, path: str='') -> InlineKeyboardBuilder:
+def _find_node(menu: Menu, data: str) -> MenuNode | None:
     """
-    Construct an InlineKeyboardBuilder object based on a given menu structure.
-    Args:
-        menu (dict): A dict with menu items to display.
-        msgid (int): message_id to place into callback data.
-        path (str, optional): A path to remember in callback data,
-            to be able to find an answer for a menu item.
+    Menu node of a pressed button, also of keyboards sent before nodes were numbered
     """
-    builder = InlineKeyboardBuilder()
-
-    for key, val in menu.items():
-        if btn := _create_button(val):
-            cbd = CBD(path=path, code=key, msgid=msgid).pack()
-            if menu.get('menumode') == MenuMode.ROW:
-                builder.button(text=btn.content['label'], callback_data=cbd)
-            else:
-                builder.row(btn.as_inline(cbd))
+    if data.startswith(NodeCBD.__prefix__ + NodeCBD.__separator__):
+        return menu.by_num(NodeCBD.unpack(data).num)
+    cbd = CBD.unpack(data)
+    return menu.find(cbd.path, cbd.code)
 
-    if path:  # build bottom row with navigation
-        btns = []
-        cbd = CBD(path='', code='', msgid=msgid).pack()
-        btns.append(InlineKeyboardButton(text='🏠', callback_data=cbd))
 
-        if '.' in path:
-            spl = path.split('.')
-            cbd = CBD(path='.'.join(spl[:-2]), code=spl[-2], msgid=msgid).pack()
-            btns.append(InlineKeyboardButton(text='←', callback_data=cbd))
+def _as_inline(node: MenuNode) -> InlineKeyboardButton:
+    if node.mode == ButtonMode.LINK:
+        return InlineKeyboardButton(text=node.label, url=node.link)
+    return InlineKeyboardButton(text=node.label, callback_data=_pack(node))
 
-        builder.row(*btns)
 
-    return builder
-
-
-def _find_menu_item(menu: dict, cbd: CallbackData) -> tuple[dict, str]:
+@functools.lru_cache(maxsize=MARKUP_CACHE_SIZE)
+def _get_markup(node: MenuNode) -> InlineKeyboardMarkup:
     """
-    Find a button info in bot menu tree by callback data.
+    Keyboard of a menu node: its children's buttons by the precomputed layout,
+    and a navigation row in submenus. The same for every message, so it's
+    built once per node.
     """
-    target = menu
-    pathlist = []
-    for lvlcode in cbd.path.split('.'):
-        if lvlcode:
-            pathlist.append(lvlcode)
-            target = target.get(lvlcode)
+    rows = [[_as_inline(child) for child in row] for row in node.layout]
 
-    pathlist.append(cbd.code)
-    return target.get(cbd.code), '.'.join(pathlist)
+    if node.parent:  # build bottom row with navigation
+        root = node.parent
+        while root.parent:
+            root = root.parent
+        btns = [InlineKeyboardButton(text='🏠', callback_data=_pack(root))]
+        if node.parent.parent:
+            btns.append(InlineKeyboardButton(text='←', callback_data=_pack(node.parent)))
+        rows.append(btns)
+
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
 @log
@@ -159,22 +104,19 @@ async def user_btn_handler(call: agtypes.CallbackQuery, *args, **kwargs):
     """
     msg = call.message
     bot, chat = msg.bot, msg.chat
-    cbd = CBD.unpack(call.data)
-    menuitem, path = _find_menu_item(bot.menu, cbd)
+    node = _find_node(bot.menu, call.data) if bot.menu else None
     sentmsg = None
 
-    if not cbd.path and not cbd.code:  # main menu
-        sentmsg = await edit_or_send_new_msg_with_keyboard(bot, chat.id, cbd, bot.menu)
-
-    elif btn := _create_button(menuitem):
-        if btn.mode == ButtonMode.MENU:
-            sentmsg = await edit_or_send_new_msg_with_keyboard(bot, chat.id, cbd, menuitem, path)
-        elif btn.mode == ButtonMode.FILE:
-            sentmsg = await send_file(bot, chat.id, menuitem)
-        elif btn.mode == ButtonMode.ANSWER:
-            sentmsg = await msg.answer(btn.answer)
-        elif btn.mode == ButtonMode.SUBJECT:
-            sentmsg = await set_subject(bot, chat, menuitem)
+    if node is None:  # a button of a menu which has changed since
+        pass
+    elif node.mode == ButtonMode.MENU:
+        sentmsg = await edit_or_send_new_msg_with_keyboard(bot, chat.id, msg.message_id, node)
+    elif node.mode == ButtonMode.FILE:
+        sentmsg = await send_file(bot, chat.id, node)
+    elif node.mode == ButtonMode.ANSWER:
+        sentmsg = await msg.answer(node.answer)
+    elif node.mode == ButtonMode.SUBJECT:
+        sentmsg = await set_subject(bot, chat, node)
 
     await save_for_destruction(sentmsg, bot)
 
@@ -204,29 +146,72 @@ async def admin_btn_handler(call: agtypes.CallbackQuery, *args, **kwargs):
     return await call.answer()
 
 
-async def send_file(bot: 'SupportBot', chat_id: int, menuitem: dict) -> agtypes.Message:
+async def send_file(bot: 'SupportBot', chat_id: int, node: MenuNode,
+                    **kwargs) -> agtypes.Message:
     """
     Shortcut for sending a file on a button press.
-    """
-    fpath = bot.botdir / 'files' / menuitem['file']
-    if fpath.is_file():
-        doc = agtypes.FSInputFile(fpath)
-        caption = _extract_answer(menuitem, empty=True)
-        return await bot.send_document(chat_id, document=doc, caption=caption)
-
-    raise FileNotFoundError(fpath.resolve())
+    The file is uploaded once, and then sent by its Telegram file_id
+    until it's changed on disk.
+    """
+    fpath = bot.botdir / 'files' / node.file
+    if not fpath.is_file():
+        raise FileNotFoundError(fpath.resolve())
+
+    stat = fpath.stat()
+    if file_id := await bot.db.fileid.get(node.file, stat.st_mtime, stat.st_size):
+        try:
+            return await bot.send_document(chat_id, document=file_id, caption=node.answer,
+                                           **kwargs)
+        except TelegramBadRequest as exc:  # file_id isn't valid anymore, upload the file again
+            await bot.log_error(exc, traceback=False)
+            await bot.db.fileid.remove(node.file)
+
+    doc = agtypes.FSInputFile(fpath)
+    sentmsg = await bot.send_document(chat_id, document=doc, caption=node.answer, **kwargs)
+    if sentmsg.document:
+        await bot.db.fileid.set(node.file, stat.st_mtime, stat.st_size,
+                                sentmsg.document.file_id)
+    return sentmsg
 
 
-async def set_subject(bot: 'SupportBot', user: agtypes.Chat, menuitem: dict) -> agtypes.Message:
+async def prewarm_files(bots: list['SupportBot']) -> None:
+    """
+    Upload the menu files which have no valid file_id yet to the admin group,
+    for bots which are set up to do so, and delete the messages right away.
+    So even the first button press sends a file by file_id.
+    """
+    for bot in bots:
+        if not (bot.cfg.prewarm_files and bot.menu):
+            continue
+        try:
+            group_id = bot.cfg.admin_group_id
+            files = {node.file: node for node in bot.menu if node.mode == ButtonMode.FILE}
+            uploaded = 0
+            with bulk_lane():
+                for path, node in files.items():
+                    try:
+                        stat = (bot.botdir / 'files' / path).stat()
+                    except OSError as exc:  # e.g. a file named in menu.toml is missing
+                        await bot.log_error(exc, traceback=False)
+                        continue
+                    if await bot.db.fileid.get(path, stat.st_mtime, stat.st_size):
+                        continue
+                    sentmsg = await send_file(bot, group_id, node, disable_notification=True)
+                    await bot.delete_message(group_id, sentmsg.message_id)
+                    uploaded += 1
+            await bot.log(f'Files uploaded to Telegram: {uploaded}')
+        except Exception as exc:
+            await bot.log_error(exc)
+
+
+async def set_subject(bot: 'SupportBot', user: agtypes.Chat, node: MenuNode) -> agtypes.Message:
     """
     Set the chosen subject to the user and report that.
     """
-    newsubj = menuitem['subject']
+    newsubj = node.subject
     group_id = bot.cfg.admin_group_id
 
-    answer = (menuitem.get('answer') or '')[:MSG_TEXT_LIMIT]
-    answer = answer or f'Please write your question about "{menuitem["label"]}"'
-    usrmsg = await bot.send_message(user.id, text=answer)
+    usrmsg = await bot.send_message(user.id, text=node.answer)
 
     if tguser := await bot.db.tguser.get(user=user):
         if tguser.thread_id and tguser.subject != newsubj:
@@ -238,53 +223,57 @@ async def set_subject(bot: 'SupportBot', user: agtypes.Chat, menuitem: dict) ->
 
 
 async def edit_or_send_new_msg_with_keyboard(
-        bot: 'SupportBot', chat_id: int, cbd: CBD, menu: dict, path: str='') -> agtypes.Message:
+        bot: 'SupportBot', chat_id: int, msg_id: int, node: MenuNode) -> agtypes.Message:
     """
     Shortcut to edit a message, or,
     if it's not possible, send a new message.
     """
-    text = _extract_answer(menu)
     try:
-        markup = _get_kb_builder(menu, cbd.msgid, path).as_markup()
-        return await bot.edit_message_text(chat_id=chat_id, message_id=cbd.msgid, text=text,
-                                           reply_markup=markup)
+        return await bot.edit_message_text(chat_id=chat_id, message_id=msg_id, text=node.answer,
+                                           reply_markup=_get_markup(node))
     except TelegramBadRequest:
-        return await send_new_msg_with_keyboard(bot, chat_id, text, menu, path)
+        return await send_new_msg_with_keyboard(bot, chat_id, node.answer, node)
 
 
 async def send_new_msg_with_keyboard(
-        bot: 'SupportBot', chat_id: int, text: str, menu: dict | None,
-        path: str='', thread_id: int | None = None) -> agtypes.Message:
+        bot: 'SupportBot', chat_id: int, text: str, node: MenuNode | None,
+        thread_id: int | None = None) -> agtypes.Message:
     """
     Shortcut to send a message with a keyboard.
     """
-    sentmsg = await bot.send_message(chat_id, text=text, disable_web_page_preview=True,
-                                     message_thread_id=thread_id)
-    if menu:
-        markup = _get_kb_builder(menu, sentmsg.message_id, path).as_markup()
-        await bot.edit_message_text(chat_id=chat_id, message_id=sentmsg.message_id, text=text,
-                                    reply_markup=markup)
-    return sentmsg
+    markup = _get_markup(node) if node else None
+    return await bot.send_message(chat_id, text=text, disable_web_page_preview=True,
+                                  message_thread_id=thread_id, reply_markup=markup)
 
 
-def build_ban_menu(banned: bool) -> dict:
+@functools.cache
+def build_ban_menu(banned: bool) -> MenuNode:
     """
     Shortcut to build a keyboard with a Ban or Unban button,
     according to the current banned state
     """
     if banned:
-        return {AdminBtn.UNBAN.value: {'label': '♻️ Unban user'}}
-    return {AdminBtn.BAN.value: {'label': '🚫 Ban user'}}
+        return Menu({AdminBtn.UNBAN.value: {'label': '♻️ Unban user'}}).root
+    return Menu({AdminBtn.BAN.value: {'label': '🚫 Ban user'}}).root
+
+
+def ban_markup(banned: bool) -> InlineKeyboardMarkup:
+    """
+    The keyboard with a Ban or Unban button, according to the current banned state
+    """
+    return _get_markup(build_ban_menu(banned))
 
 
-def build_cancel_menu() -> dict:
+@functools.cache
+def build_cancel_menu() -> MenuNode:
     """
     Shortcut to build a keyboard with a single Cancel button
     """
-    return {'cancel': {'label': '🚫 Cancel'}}
+    return Menu({'cancel': {'label': '🚫 Cancel'}}).root
 
 
-def build_confirm_menu(yes_answer: str='Confirmed', no_answer: str='Canceled') -> dict:
+@functools.cache
+def build_confirm_menu(yes_answer: str='Confirmed', no_answer: str='Canceled') -> MenuNode:
     """
     Shortcut to build typical confirmation keyboard
     """
@@ -293,4 +282,4 @@ def build_confirm_menu(yes_answer: str='Confirmed', no_answer: str='Canceled') -
         'no': {'label': '🚫 No', 'answer': no_answer},
         'menumode': MenuMode.ROW,
     }
-    return menu
+    return Menu(menu).root
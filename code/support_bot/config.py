@@ -30,12 +30,18 @@ class BotConfig(BaseModel):
     db_engine: str = 'aiosqlite'
     save_messages_gsheets_cred_file: Path | None = None  # resolved against botdir
     save_messages_gsheets_filename: str | None = None
+    save_messages_archive: bool = False
     destruct_user_messages_for_user: Hours | None = None
     destruct_bot_messages_for_user: Hours | None = None
+    destruct_concurrency: Annotated[int, Field(ge=1)] = 8  # chats cleaned up in parallel
     send_mode: SendMode = SendMode.REPLY
     mirror_replies: bool = False
     mirror_reactions: bool = False
     admin_only_actions: bool = True
+    prewarm_files: bool = False
+    antiflood_messages: Annotated[int, Field(ge=1)] | None = None  # per antiflood_window
+    antiflood_window: Annotated[int, Field(ge=1)] = 60  # seconds
+    antiflood_notify: bool = True
 
     @field_validator('send_mode', mode='before')
     @classmethod
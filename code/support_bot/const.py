@@ -2,6 +2,7 @@ import enum
 
 
 MSG_TEXT_LIMIT = 4096
+DELETE_MESSAGES_LIMIT = 100  # max message ids in a single deleteMessages call
 
 # Fixed service account Telegram substitutes as the sender for anonymous group admins
 ANONYMOUS_ADMIN_ID = 1087968824
@@ -67,6 +68,11 @@ class SendMode(BaseEnum):
     ALL_EXCEPT_ADMINS = 'all_except_admins'
 
 
+class Lane(BaseEnum):
+    INTERACTIVE = 'interactive'  # relaying messages, menus, replies to admins
+    BULK = 'bulk'  # broadcasts, destruction, cleanup, reports
+
+
 class ActionName(enum.Enum):
     new_user = 'new_user', 'New user'
     user_message = 'user_message', 'User message'
@@ -1,21 +1,33 @@
+import asyncio
 import datetime
-from collections.abc import Sequence
-from dataclasses import asdict, dataclass
+import logging
+from collections import Counter, OrderedDict
+from collections.abc import AsyncIterator, Callable, Sequence
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, fields, replace
 from pathlib import Path
 
 import aiogram.types as agtypes
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.engine.row import Row as SaRow
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.sql import false
+from sqlalchemy.sql import false, true
 
 from .const import ActionName
+from .utils import BufferedFlusher
 
 
 Base = declarative_base()
 BASE_DIR = Path(__file__).resolve().parent.parent
+logger = logging.getLogger(__name__)
+
+TGUSER_CACHE_SIZE = 10_000  # rows kept in memory by SqlTgUser, least recently used are evicted
+MSGTODEL_BATCH_SIZE = 100  # SqlMessageToDelete writes its buffer when it has this many rows...
+MSGTODEL_FLUSH_DELAY = 0.5  # ...or this many seconds after the first buffered row
+UPSERT_INSERTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}  # by dialect name
 
 
 class TgUsers(Base):
@@ -30,6 +42,7 @@ class TgUsers(Base):
     subject = sa.Column(sa.String(32))
     banned = sa.Column(sa.Boolean, default=False, nullable=False)
     first_replied = sa.Column(sa.Boolean, server_default=false(), nullable=False)
+    reachable = sa.Column(sa.Boolean, server_default=true(), nullable=False)  # not blocked the bot
 
 
 class ActionStats(Base):
@@ -56,6 +69,7 @@ class MessagesToDelete(Base):
 
     __table_args__ = (
         sa.UniqueConstraint('chat_id', 'msg_id'),
+        sa.Index('ix_messages_to_delete_by_bot_sent_at', 'by_bot', 'sent_at'),
     )
 
 
@@ -73,10 +87,45 @@ class MessageMap(Base):
     )
 
 
+class Broadcasts(Base):
+    __tablename__ = 'broadcasts'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    chat_id = sa.Column(sa.BigInteger, nullable=False)  # where the message and progress are
+    message_id = sa.Column(sa.Integer, nullable=False)  # the message to copy to users
+    progress_msg_id = sa.Column(sa.Integer, nullable=False)
+    last_user_id = sa.Column(sa.BigInteger, default=0, nullable=False)  # users up to it are done
+    success = sa.Column(sa.Integer, default=0, nullable=False)
+    forbidden = sa.Column(sa.Integer, default=0, nullable=False)
+    failed = sa.Column(sa.Integer, default=0, nullable=False)
+    created_at = sa.Column(sa.DateTime, nullable=False)
+    finished_at = sa.Column(sa.DateTime)
+    error = sa.Column(sa.String)  # why the broadcast was stopped, if it failed
+
+
+class FileIds(Base):
+    __tablename__ = 'file_ids'
+
+    path = sa.Column(sa.String, primary_key=True)  # relative to the bot's files dir
+    mtime = sa.Column(sa.Float, nullable=False)
+    size = sa.Column(sa.Integer, nullable=False)
+    file_id = sa.Column(sa.String, nullable=False)  # of the file uploaded to Telegram
+
+
+class GsheetsSpool(Base):
+    __tablename__ = 'gsheets_spool'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    cells = sa.Column(sa.JSON, nullable=False)  # the row values, in the order of the columns
+    highlight = sa.Column(sa.Boolean, default=False, nullable=False)
+    worksheet = sa.Column(sa.String)  # month of the message, the current one if not set
+
+
 @dataclass
 class DbTgUser:
     """
-    Fake TgUser to return inserted TgUser row without another DB query
+    Fake TgUser to return inserted TgUser row without another DB query.
+    Also the form TgUsers rows are kept in the cache.
     """
     user_id: int
     full_name: str
@@ -86,6 +135,150 @@ class DbTgUser:
     subject: str | None = None
     banned: bool = False
     first_replied: bool = False  # whether first_reply has been sent or not
+    reachable: bool = True  # False when the user blocked the bot
+
+    @classmethod
+    def from_row(cls, row: SaRow) -> 'DbTgUser':
+        return cls(**{f.name: getattr(row, f.name) for f in fields(cls)})
+
+
+@dataclass(frozen=True)
+class CacheInfo:
+    hits: int
+    misses: int
+    size: int
+    maxsize: int
+
+
+class TgUserCache:
+    """
+    Bounded LRU cache of TgUsers rows, indexed by user_id and by thread_id.
+    Rows are stored as DbTgUser snapshots, replaced (never mutated) on change.
+    Writes are numbered, so a row read from the DB is not cached if its user
+    was written while the read was in flight: the row may be stale by then.
+    """
+    def __init__(self, maxsize: int = TGUSER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._by_user: OrderedDict[int, DbTgUser] = OrderedDict()
+        self._by_thread: dict[int, int] = {}  # thread_id -> user_id
+        self._generation = 0  # number of the last write
+        self._written: dict[int, int] = {}  # user_id -> generation, while reads are in flight
+        self._reads: Counter[int] = Counter()  # generations the reads in flight started at
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, len(self._by_user), self.maxsize)
+
+    def get(self, user_id: int | None = None, thread_id: int | None = None) -> DbTgUser | None:
+        if user_id is None:
+            user_id = self._by_thread.get(thread_id)
+
+        tguser = self._by_user.get(user_id) if user_id is not None else None
+        if tguser is None:
+            self.misses += 1
+            return None
+
+        self._by_user.move_to_end(user_id)
+        self.hits += 1
+        return tguser
+
+    def put(self, tguser: DbTgUser) -> None:
+        """
+        Cache a row just written to the DB
+        """
+        self._write(tguser.user_id)
+        self._store(tguser)
+
+    def update(self, user_id: int, **kwargs) -> None:
+        """
+        Apply changed fields to a cached row, if it's cached
+        """
+        self._write(user_id)
+        if (tguser := self._by_user.get(user_id)) is not None:
+            self._store(replace(tguser, **kwargs))
+
+    def start_read(self) -> int:
+        """
+        Register a DB read, return the generation to pass to `finish_read`
+        """
+        self._reads[self._generation] += 1
+        return self._generation
+
+    def finish_read(self, generation: int, tguser: DbTgUser | None) -> None:
+        """
+        Cache the row read, unless its user was written since the read started
+        """
+        if tguser is not None and self._written.get(tguser.user_id, 0) <= generation:
+            self._store(tguser)
+
+        self._reads[generation] -= 1
+        if not self._reads[generation]:
+            del self._reads[generation]
+        if not self._reads:
+            self._written.clear()
+        elif len(self._written) > self.maxsize:
+            oldest = min(self._reads)
+            self._written = {uid: gen for uid, gen in self._written.items() if gen > oldest}
+
+    def discard(self, user_id: int) -> None:
+        if (tguser := self._by_user.pop(user_id, None)) is not None:
+            self._drop_thread(tguser)
+
+    def _write(self, user_id: int) -> None:
+        self._generation += 1
+        if self._reads:
+            self._written[user_id] = self._generation
+
+    def _store(self, tguser: DbTgUser) -> None:
+        self.discard(tguser.user_id)
+        self._by_user[tguser.user_id] = tguser
+        if tguser.thread_id is not None:
+            self._by_thread[tguser.thread_id] = tguser.user_id
+
+        while len(self._by_user) > self.maxsize:
+            _, evicted = self._by_user.popitem(last=False)
+            self._drop_thread(evicted)
+
+    def _drop_thread(self, tguser: DbTgUser) -> None:
+        if self._by_thread.get(tguser.thread_id) == tguser.user_id:
+            del self._by_thread[tguser.thread_id]
+
+
+class SqlUnitOfWork:
+    """
+    Writes of several repositories collected to be committed in one transaction.
+    Repository methods accepting `uow` queue their statements here instead of
+    executing them, and postpone their in-memory side effects (like cache
+    updates) until the commit succeeds.
+    """
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self._stmts: list[sa.Executable] = []
+        self._on_commit: list[Callable[[], None]] = []
+
+    def add(self, *stmts: sa.Executable, on_commit: Callable[[], None] | None = None) -> None:
+        self._stmts.extend(stmts)
+        if on_commit:
+            self._on_commit.append(on_commit)
+
+    async def commit(self) -> None:
+        stmts, on_commit = self._stmts, self._on_commit
+        self._stmts, self._on_commit = [], []
+
+        if stmts:
+            async with self.engine.begin() as conn:
+                for stmt in stmts:
+                    await conn.execute(stmt)
+        for callback in on_commit:
+            callback()
+
+
+def _upsert(engine: AsyncEngine, table: type[Base]) -> sa.Insert:
+    """
+    INSERT of the engine's dialect, which has ON CONFLICT clauses
+    """
+    return UPSERT_INSERTS[engine.dialect.name](table)
 
 
 class SqlDb:
@@ -95,10 +288,37 @@ class SqlDb:
     def __init__(self, url: str):
         self.url = url
         self.engine = create_async_engine(url)
+        if self.engine.dialect.name not in UPSERT_INSERTS:
+            raise ValueError(f'Unsupported database: {self.engine.dialect.name}. '
+                             f'Supported are: {", ".join(UPSERT_INSERTS)}')
         self.tguser = SqlTgUser(self.engine)
         self.action = SqlAction(self.engine)
         self.msgtodel = SqlMessageToDelete(self.engine)
         self.msgmap = SqlMessageMap(self.engine)
+        self.broadcast = SqlBroadcast(self.engine)
+        self.gsheets_spool = SqlGsheetsSpool(self.engine)
+        self.fileid = SqlFileId(self.engine)
+
+    async def flush(self) -> None:
+        """
+        Write the data repositories keep in memory
+        """
+        await self.action.flush()
+        await self.msgtodel.flush()
+
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[SqlUnitOfWork]:
+        """
+        Batch the writes made inside the block into one transaction,
+        committed on a clean exit and discarded on an exception:
+
+            async with db.unit_of_work() as uow:
+                await db.tguser.update(user_id, uow=uow, ...)
+                await db.msgmap.add(..., uow=uow)
+        """
+        uow = SqlUnitOfWork(self.engine)
+        yield uow
+        await uow.commit()
 
 
 class SqlRepo:
@@ -108,45 +328,81 @@ class SqlRepo:
     def __init__(self, engine: AsyncEngine):
         self.engine = engine
 
+    async def _execute(self, *stmts: sa.Executable, uow: SqlUnitOfWork | None = None,
+                       on_commit: Callable[[], None] | None = None) -> None:
+        """
+        Run write statements in their own transaction, or queue them to a unit of work
+        """
+        if uow is not None:
+            uow.add(*stmts, on_commit=on_commit)
+            return
+
+        async with self.engine.begin() as conn:
+            for stmt in stmts:
+                await conn.execute(stmt)
+        if on_commit:
+            on_commit()
+
 
 class SqlTgUser(SqlRepo):
     """
-    Repository for TgUsers table
+    Repository for TgUsers table.
+    Reads by user_id or thread_id are served from a write-through cache,
+    so every write to the table must go through this repository.
     """
+    _is_recipient = (TgUsers.banned == false()) & (TgUsers.reachable == true())
+
+    def __init__(self, engine: AsyncEngine):
+        super().__init__(engine)
+        self.cache = TgUserCache()
+
     async def add(self,
                   user: agtypes.User,
                   user_msg: agtypes.Message,
                   thread_id: int | None = None,
-                  first_replied: bool = False) -> DbTgUser:
+                  first_replied: bool = False,
+                  uow: SqlUnitOfWork | None = None) -> DbTgUser:
         tguser = DbTgUser(
             user_id=user.id, full_name=user.full_name, username=user.username, thread_id=thread_id,
             last_user_msg_at=user_msg.date.replace(tzinfo=None), first_replied=first_replied,
         )
-        async with self.engine.begin() as conn:
-            await conn.execute(sa.delete(TgUsers).filter_by(user_id=user.id))
-            await conn.execute(sa.insert(TgUsers).values(**asdict(tguser)))
-
+        await self._execute(
+            sa.delete(TgUsers).filter_by(user_id=user.id),
+            sa.insert(TgUsers).values(**asdict(tguser)),
+            uow=uow, on_commit=lambda: self.cache.put(tguser),
+        )
         return tguser
 
     async def get(self,
                   user: agtypes.User | None = None,
                   thread_id: int | None = None,
-                  user_id: int | None = None) -> SaRow | None:
+                  user_id: int | None = None) -> DbTgUser | None:
         if user:
             user_id = user.id
         if user_id:
+            if tguser := self.cache.get(user_id=user_id):
+                return tguser
             query = sa.select(TgUsers).where(TgUsers.user_id==user_id)
         else:
+            if thread_id is not None and (tguser := self.cache.get(thread_id=thread_id)):
+                return tguser
             query = sa.select(TgUsers).where(TgUsers.thread_id==thread_id)
 
-        async with self.engine.begin() as conn:
-            result = await conn.execute(query)
-            if row := result.fetchone():
-                return row
+        tguser = None
+        generation = self.cache.start_read()
+        try:
+            async with self.engine.begin() as conn:
+                result = await conn.execute(query)
+                if row := result.fetchone():
+                    tguser = DbTgUser.from_row(row)
+        finally:
+            self.cache.finish_read(generation, tguser)
+        return tguser
 
     async def update(self,
                      user_id: int,
                      user_msg: agtypes.Message | None = None,
+                     uow: SqlUnitOfWork | None = None,
                      **kwargs) -> None:
         """
         Update TgUser fields (thread_id, subject, etc) provided as kwargs.
@@ -155,18 +411,61 @@ class SqlTgUser(SqlRepo):
         if user_msg:
             kwargs['last_user_msg_at'] = user_msg.date.replace(tzinfo=None)
 
-        async with self.engine.begin() as conn:
-            await conn.execute(sa.update(TgUsers).where(TgUsers.user_id==user_id).values(**kwargs))
+        await self._execute(
+            sa.update(TgUsers).where(TgUsers.user_id==user_id).values(**kwargs),
+            uow=uow, on_commit=lambda: self.cache.update(user_id, **kwargs),
+        )
 
     async def del_thread_id(self, user_id: int) -> None:
         async with self.engine.begin() as conn:
             query = sa.update(TgUsers).where(TgUsers.user_id==user_id).values(thread_id=None)
             await conn.execute(query)
 
-    async def get_all(self) -> Sequence[SaRow]:
+        self.cache.update(user_id, thread_id=None)
+
+    async def set_reachable(self, user_ids: Sequence[int], reachable: bool) -> None:
+        """
+        Bulk version of update(user_id, reachable=...)
+        """
+        if not user_ids:
+            return
+
+        def update_cache():
+            for user_id in user_ids:
+                self.cache.update(user_id, reachable=reachable)
+
+        query = (sa.update(TgUsers).where(TgUsers.user_id.in_(user_ids))
+                 .values(reachable=reachable))
+        await self._execute(query, on_commit=update_cache)
+
+    async def iter_recipients(self, after_user_id: int = 0,
+                              page_size: int = 500) -> AsyncIterator[int]:
+        """
+        Stream ids of users to broadcast to (not banned, not blocked the bot)
+        with user_id greater than the given one, in user_id order. Reads page
+        by page with a keyset cursor, so neither memory nor a long-running
+        transaction grows with the number of users.
+        """
+        while True:
+            query = (
+                sa.select(TgUsers.user_id)
+                .where((TgUsers.user_id > after_user_id) & self._is_recipient)
+                .order_by(TgUsers.user_id).limit(page_size)
+            )
+            async with self.engine.begin() as conn:
+                user_ids = (await conn.execute(query)).scalars().all()
+
+            for user_id in user_ids:
+                yield user_id
+            if len(user_ids) < page_size:
+                return
+            after_user_id = user_ids[-1]
+
+    async def count_recipients(self, after_user_id: int = 0) -> int:
+        query = sa.select(sa.func.count()).select_from(TgUsers).where(
+            (TgUsers.user_id > after_user_id) & self._is_recipient)
         async with self.engine.begin() as conn:
-            result = await conn.execute(sa.select(TgUsers))
-            return result.fetchall()
+            return (await conn.execute(query)).scalar()
 
     async def get_olds(self) -> Sequence[SaRow]:
         async with self.engine.begin() as conn:
@@ -179,53 +478,93 @@ class SqlTgUser(SqlRepo):
 
 class SqlAction(SqlRepo):
     """
-    Repository for ActionStats table
+    Repository for ActionStats table.
+    Counts are aggregated in memory per (name, date) and written by `flush`,
+    which the scheduler calls every few seconds and on shutdown.
+    Reads add the counts not flushed yet, so they are always exact.
     """
-    async def add(self, name: str) -> None:
+    def __init__(self, engine: AsyncEngine):
+        super().__init__(engine)
+        self._pending: Counter[tuple[ActionName, datetime.date]] = Counter()
+        self._flush_lock = asyncio.Lock()  # reads wait for a flush in progress
+
+    async def add(self, name: ActionName) -> None:
         """
         Sum it with the existing action count for today
         """
-        async with self.engine.begin() as conn:
-            vals = {'name': name, 'date': datetime.date.today(), 'count': 1}
-            insert_q = sa.insert(ActionStats).values(vals)
-            update_q = sa.update(ActionStats).values(count=ActionStats.count + 1).where(
-                (ActionStats.name == vals['name']) & (ActionStats.date == vals['date'])
+        self._pending[name, datetime.date.today()] += 1
+
+    async def flush(self) -> None:
+        """
+        Add the pending counts to the table with a single upsert
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, Counter()
+
+            query = _upsert(self.engine, ActionStats)
+            query = query.on_conflict_do_update(
+                index_elements=['name', 'date'],
+                set_={'count': ActionStats.count + query.excluded.count},
             )
+            rows = [{'name': name, 'date': date, 'count': count}
+                    for (name, date), count in pending.items()]
             try:
-                await conn.execute(insert_q)
-            except IntegrityError:
-                await conn.execute(update_q)
-
-    async def get_grouped(self, from_date: datetime.date) -> Sequence[SaRow]:
+                async with self.engine.begin() as conn:
+                    await conn.execute(query, rows)
+            except Exception:
+                self._pending.update(pending)  # retry on the next flush
+                raise
+
+    def _add_pending(self, rows: Sequence[SaRow],
+                     from_date: datetime.date | None = None) -> list[tuple[ActionName, int]]:
+        totals = dict(rows)
+        for (name, date), count in self._pending.items():
+            if from_date is None or date >= from_date:
+                totals[name] = totals.get(name, 0) + count
+        return list(totals.items())
+
+    async def get_grouped(self, from_date: datetime.date) -> list[tuple[ActionName, int]]:
         """
         Statistics over time starting from "from_date"
         """
-        async with self.engine.begin() as conn:
+        async with self._flush_lock, self.engine.begin() as conn:
             query = (
                 sa.select(ActionStats.name, sa.func.sum(ActionStats.count))
                 .where(ActionStats.date >= from_date)
                 .group_by(ActionStats.name)
             )
             result = await conn.execute(query)
-            return result.fetchall()
+            return self._add_pending(result.fetchall(), from_date)
 
-    async def get_total(self) -> Sequence[SaRow]:
+    async def get_total(self) -> list[tuple[ActionName, int]]:
         """
         Statistics over entire bot existence time
         """
-        async with self.engine.begin() as conn:
+        async with self._flush_lock, self.engine.begin() as conn:
             query = (
                 sa.select(ActionStats.name, sa.func.sum(ActionStats.count))
                 .group_by(ActionStats.name)
             )
             result = await conn.execute(query)
-            return result.fetchall()
+            return self._add_pending(result.fetchall())
 
 
 class SqlMessageToDelete(SqlRepo):
     """
-    Repository for MessagesToDelete table
+    Repository for MessagesToDelete table.
+    New rows are buffered in memory and inserted in batches in the background,
+    so remembering a message doesn't cost a transaction. `flush` writes the
+    buffer right away; it's called before reading and on shutdown.
     """
+    def __init__(self, engine: AsyncEngine):
+        super().__init__(engine)
+        self._buffer: list[dict] = []
+        self._flush_lock = asyncio.Lock()
+        self._flusher = BufferedFlusher(self.flush, self._log_flush_error,
+                                        MSGTODEL_BATCH_SIZE, MSGTODEL_FLUSH_DELAY)
+
     async def add(self, msg: agtypes.Message | agtypes.MessageId,
                   chat_id: int | None = None) -> None:
         """
@@ -234,34 +573,63 @@ class SqlMessageToDelete(SqlRepo):
         if chat_id:  # special case when the message was copied
             vals = {'chat_id': chat_id, 'sent_at': datetime.datetime.utcnow(), 'by_bot': True}
         else:  # the usual full message object
-            vals = {'chat_id': msg.chat.id, 'sent_at': msg.date, 'by_bot': msg.from_user.is_bot}
+            sent_at = msg.date.replace(tzinfo=None)
+            vals = {'chat_id': msg.chat.id, 'sent_at': sent_at, 'by_bot': msg.from_user.is_bot}
 
         vals['msg_id'] = msg.message_id
+        self._buffer.append(vals)
 
-        async with self.engine.begin() as conn:
-            try:
-                await conn.execute(sa.insert(MessagesToDelete).values(vals))
-            except IntegrityError:
-                pass  # such message already in the db
+        self._flusher.added(len(self._buffer))
 
-    async def get_many(self, before: datetime.datetime, by_bot: bool) -> Sequence[SaRow]:
+    async def _log_flush_error(self, exc: Exception) -> None:
+        logger.error('Failed to save messages to delete', exc_info=exc)
+
+    async def flush(self) -> None:
         """
-        Statistics over entire bot existence time
+        Insert the buffered rows with one executemany, skipping known messages
+        """
+        async with self._flush_lock:
+            self._flusher.cancel_timer()
+            if not self._buffer:
+                return
+            rows, self._buffer = self._buffer, []
+
+            query = _upsert(self.engine, MessagesToDelete).on_conflict_do_nothing(
+                index_elements=['chat_id', 'msg_id'],  # such message already in the db
+            )
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(query, rows)
+            except Exception:
+                self._buffer[:0] = rows
+                raise
+
+    async def get_many(self, before: datetime.datetime, by_bot: bool,
+                       after: datetime.datetime | None = None) -> Sequence[SaRow]:
+        """
+        Messages of the kind sent before the given time (and after, if given)
         """
+        await self.flush()
+        query = sa.select(MessagesToDelete).where(
+            (MessagesToDelete.by_bot == by_bot) & (MessagesToDelete.sent_at <= before))
+        if after is not None:
+            query = query.where(MessagesToDelete.sent_at > after)
+
         async with self.engine.begin() as conn:
-            query = sa.select(MessagesToDelete).where(
-                (MessagesToDelete.sent_at <= before) & (MessagesToDelete.by_bot == by_bot))
             result = await conn.execute(query)
             return result.fetchall()
 
     async def remove(self, msgs: Sequence[SaRow]) -> None:
         """
-        Remove rows with these ids
+        Remove rows of these messages, identified by chat_id and msg_id
         """
-        if ids := [msg.id for msg in msgs]:
+        await self.flush()  # or a buffered row would come back after removal
+        if keys := [(msg.chat_id, msg.msg_id) for msg in msgs]:
+            columns = sa.tuple_(MessagesToDelete.chat_id, MessagesToDelete.msg_id)
             async with self.engine.begin() as conn:
-                query = sa.delete(MessagesToDelete).filter(MessagesToDelete.id.in_(ids))
-                await conn.execute(query)
+                for i in range(0, len(keys), 500):  # keep under SQLite's bound parameters limit
+                    query = sa.delete(MessagesToDelete).filter(columns.in_(keys[i:i + 500]))
+                    await conn.execute(query)
 
 
 class SqlMessageMap(SqlRepo):
@@ -269,10 +637,10 @@ class SqlMessageMap(SqlRepo):
     Repository for MessageMap table. A row pairs a message in the admin chat
     with the corresponding message in the user chat (in either direction).
     """
-    async def add(self, admin_msg_id: int, user_id: int, user_msg_id: int) -> None:
+    async def add(self, admin_msg_id: int, user_id: int, user_msg_id: int,
+                  uow: SqlUnitOfWork | None = None) -> None:
         vals = {'admin_msg_id': admin_msg_id, 'user_id': user_id, 'user_msg_id': user_msg_id}
-        async with self.engine.begin() as conn:
-            await conn.execute(sa.insert(MessageMap).values(vals))
+        await self._execute(sa.insert(MessageMap).values(vals), uow=uow)
 
     async def get(self, admin_msg_id: int) -> SaRow | None:
         query = sa.select(MessageMap).where(MessageMap.admin_msg_id==admin_msg_id)
@@ -287,3 +655,76 @@ class SqlMessageMap(SqlRepo):
         async with self.engine.begin() as conn:
             result = await conn.execute(query)
             return result.fetchone()
+
+
+class SqlFileId(SqlRepo):
+    """
+    Repository for FileIds table: Telegram file_ids of uploaded files,
+    valid while the file's mtime and size stay the same
+    """
+    async def get(self, path: str, mtime: float, size: int) -> str | None:
+        query = sa.select(FileIds.file_id).where(
+            (FileIds.path == path) & (FileIds.mtime == mtime) & (FileIds.size == size))
+        async with self.engine.begin() as conn:
+            result = await conn.execute(query)
+            return result.scalar()
+
+    async def set(self, path: str, mtime: float, size: int, file_id: str) -> None:
+        vals = {'path': path, 'mtime': mtime, 'size': size, 'file_id': file_id}
+        query = _upsert(self.engine, FileIds).values(vals).on_conflict_do_update(
+            index_elements=['path'], set_={k: v for k, v in vals.items() if k != 'path'})
+        await self._execute(query)
+
+    async def remove(self, path: str) -> None:
+        await self._execute(sa.delete(FileIds).where(FileIds.path == path))
+
+
+class SqlBroadcast(SqlRepo):
+    """
+    Repository for Broadcasts table. A row keeps a broadcast's progress,
+    so an interrupted broadcast can be resumed.
+    """
+    async def add(self, chat_id: int, message_id: int, progress_msg_id: int) -> SaRow:
+        vals = {'chat_id': chat_id, 'message_id': message_id, 'progress_msg_id': progress_msg_id,
+                'created_at': datetime.datetime.utcnow()}
+        async with self.engine.begin() as conn:
+            result = await conn.execute(sa.insert(Broadcasts).values(vals).returning(Broadcasts))
+            return result.fetchone()
+
+    async def update(self, broadcast_id: int, **kwargs) -> None:
+        """
+        Update Broadcast fields (last_user_id, counters, finished_at, error) provided as kwargs
+        """
+        await self._execute(
+            sa.update(Broadcasts).where(Broadcasts.id == broadcast_id).values(**kwargs))
+
+    async def get_unfinished(self) -> Sequence[SaRow]:
+        query = sa.select(Broadcasts).where(Broadcasts.finished_at.is_(None))
+        async with self.engine.begin() as conn:
+            result = await conn.execute(query)
+            return result.fetchall()
+
+
+class SqlGsheetsSpool(SqlRepo):
+    """
+    Repository for GsheetsSpool table: rows kept until they're appended
+    to Google Sheets, in the order they were added
+    """
+    async def add_many(self, rows: list[dict]) -> None:
+        """
+        Spool rows of `cells`, `highlight` and `worksheet`, with one executemany
+        """
+        async with self.engine.begin() as conn:
+            await conn.execute(sa.insert(GsheetsSpool), rows)
+
+    async def get_first(self, limit: int) -> Sequence[SaRow]:
+        query = sa.select(GsheetsSpool).order_by(GsheetsSpool.id).limit(limit)
+        async with self.engine.begin() as conn:
+            result = await conn.execute(query)
+            return result.fetchall()
+
+    async def remove_up_to(self, spool_id: int) -> None:
+        """
+        Remove the rows already written to Google Sheets
+        """
+        await self._execute(sa.delete(GsheetsSpool).where(GsheetsSpool.id <= spool_id))
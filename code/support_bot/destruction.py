@@ -0,0 +1,191 @@
+"""
+Delete messages in user chats when their time comes,
+if a bot is set up to do so
+"""
+import asyncio
+import datetime
+import heapq
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from .const import DELETE_MESSAGES_LIMIT
+from .ratelimit import bulk_lane
+
+if TYPE_CHECKING:
+    from .bot import SupportBot
+
+
+WINDOW = datetime.timedelta(minutes=10)  # how far ahead due messages are loaded from the DB
+RETRY_DELAY = datetime.timedelta(minutes=10)  # a failed deletion is retried after this time
+DEADLINE = datetime.timedelta(hours=48)  # Telegram doesn't delete messages older than this
+MIN_INTERVAL = 5  # seconds between deletions, so close due times are deleted together
+
+
+@dataclass(order=True, frozen=True)
+class DueMessage:
+    due_at: datetime.datetime
+    chat_id: int
+    msg_id: int
+    sent_at: datetime.datetime = field(compare=False)
+
+
+class DestructionScheduler:
+    """
+    Keeps the bot's messages due within the next WINDOW in a heap,
+    and deletes them close to their due time.
+    The heap is fed by loading the next window from the DB, which is also
+    how it's seeded on startup. New messages don't need to be queued
+    directly: the shortest lifetime (an hour) is longer than the window,
+    so they are always loaded with a later window.
+    A message leaves the queue when it's deleted, when Telegram rejects
+    the deletion as impossible (too old, already deleted), or when it's
+    past Telegram's 48-hour deletion window anyway. A message which failed
+    for any other reason is retried after RETRY_DELAY.
+    """
+    def __init__(self, bot: 'SupportBot'):
+        self.bot = bot
+        self._heap: list[DueMessage] = []
+        self._queued: set[tuple[int, int]] = set()  # (chat_id, msg_id) of the heap items
+        self._horizon: datetime.datetime | None = None  # messages due before it are loaded
+        self._task: asyncio.Task | None = None
+
+    def _lifetime(self, by_bot: bool) -> datetime.timedelta | None:
+        var = 'destruct_bot_messages_for_user' if by_bot else 'destruct_user_messages_for_user'
+        hours = getattr(self.bot.cfg, var)
+        return datetime.timedelta(hours=hours) if hours else None
+
+    def start(self) -> None:
+        if self._lifetime(by_bot=False) or self._lifetime(by_bot=True):
+            with bulk_lane():
+                self._task = asyncio.create_task(self._run())
+
+    def _queue(self, item: DueMessage) -> None:
+        if (item.chat_id, item.msg_id) in self._queued:
+            return
+        self._queued.add((item.chat_id, item.msg_id))
+        heapq.heappush(self._heap, item)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                now = datetime.datetime.utcnow()
+                if self._horizon is None or now + WINDOW / 2 >= self._horizon:
+                    await self._load_window(now)
+                await self._destruct_due(now)
+            except Exception as exc:
+                await self.bot.log_error(exc)
+            await self._sleep()
+
+    async def _load_window(self, now: datetime.datetime) -> None:
+        """
+        Load messages due after the current horizon and up to now + WINDOW,
+        using the (by_bot, sent_at) index
+        """
+        start, self._horizon = self._horizon, now + WINDOW
+        try:
+            for by_bot in False, True:
+                if lifetime := self._lifetime(by_bot):
+                    after = start - lifetime if start else None
+                    before = self._horizon - lifetime
+                    for row in await self.bot.db.msgtodel.get_many(before, by_bot, after):
+                        self._queue(DueMessage(row.sent_at + lifetime, row.chat_id, row.msg_id,
+                                               row.sent_at))
+        except Exception:
+            self._horizon = start  # load the window again on the next run
+            raise
+
+    async def _sleep(self) -> None:
+        now = datetime.datetime.utcnow()
+        wake_at = self._horizon - WINDOW / 2 if self._horizon else now
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0].due_at)
+        await asyncio.sleep(max((wake_at - now).total_seconds(), MIN_INTERVAL))
+
+    async def _destruct_due(self, now: datetime.datetime) -> None:
+        due = []
+        while self._heap and self._heap[0].due_at <= now:
+            item = heapq.heappop(self._heap)
+            self._queued.discard((item.chat_id, item.msg_id))
+            due.append(item)
+        if not due:
+            return
+
+        try:
+            to_remove, destructed, error = await destruct_messages(self.bot, due)
+            await self.bot.db.msgtodel.remove(to_remove)
+        except Exception:
+            self._retry(due, now)
+            raise
+
+        removed = set(to_remove)
+        self._retry([item for item in due if item not in removed], now)
+
+        if error:
+            await self.bot.log_error(error)
+        if destructed:
+            await self.bot.log(f'Messages destructed: {destructed}')
+        if undeletable := len(to_remove) - destructed:
+            await self.bot.log(
+                f'Messages impossible to delete, dropped from the queue: {undeletable}')
+
+    def _retry(self, items: list[DueMessage], now: datetime.datetime) -> None:
+        for item in items:
+            self._queue(DueMessage(now + RETRY_DELAY, item.chat_id, item.msg_id, item.sent_at))
+
+
+async def destruct_messages(bot: 'SupportBot', msgs: list[DueMessage]
+                            ) -> tuple[list[DueMessage], int, Exception | None]:
+    """
+    Delete the messages grouped by chat: several chats are processed
+    concurrently, each one with deleteMessages in chunks.
+    Returns messages to drop from the queue, how many of them were deleted,
+    and the first unexpected error, if any.
+    """
+    deadline = datetime.datetime.utcnow() - DEADLINE
+    by_chat = defaultdict(list)
+    for msg in msgs:
+        by_chat[msg.chat_id].append(msg)
+
+    semaphore = asyncio.Semaphore(bot.cfg.destruct_concurrency)
+    results = await asyncio.gather(*(
+        _destruct_chat_messages(bot, chat_id, chat_msgs, deadline, semaphore)
+        for chat_id, chat_msgs in by_chat.items()
+    ))
+
+    to_remove, destructed, error = [], 0, None
+    for chat_removed, chat_destructed, chat_error in results:
+        to_remove += chat_removed
+        destructed += chat_destructed
+        error = error or chat_error
+    return to_remove, destructed, error
+
+
+async def _destruct_chat_messages(
+        bot: 'SupportBot', chat_id: int, msgs: list[DueMessage], deadline: datetime.datetime,
+        semaphore: asyncio.Semaphore) -> tuple[list[DueMessage], int, Exception | None]:
+    """
+    Delete messages of one chat, by chunks of up to DELETE_MESSAGES_LIMIT
+    """
+    to_remove, destructed, error = [], 0, None
+
+    async with semaphore:
+        for i in range(0, len(msgs), DELETE_MESSAGES_LIMIT):
+            chunk = msgs[i:i + DELETE_MESSAGES_LIMIT]
+            try:
+                await bot.delete_messages(chat_id, [msg.msg_id for msg in chunk])
+                destructed += len(chunk)
+                to_remove += chunk
+            except TelegramBadRequest:  # none of them can be deleted
+                to_remove += chunk
+            except TelegramForbiddenError:  # the user blocked the bot, drop the rest too
+                to_remove += msgs[i:]
+                await bot.db.tguser.update(chat_id, reachable=False)
+                break
+            except Exception as exc:
+                to_remove += [msg for msg in chunk if msg.sent_at <= deadline]
+                error = error or exc
+
+    return to_remove, destructed, error
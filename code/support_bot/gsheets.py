@@ -1,45 +1,68 @@
 """
 Work with Google Sheets
 """
+import asyncio
+import functools
+import itertools
 import string
 from datetime import datetime
+from pathlib import Path
 from typing import TYPE_CHECKING, Any
 
 import aiogram.types as agtypes
 import gspread_asyncio
+from google.oauth2.service_account import Credentials
 from gspread_asyncio import (
     AsyncioGspreadClient, AsyncioGspreadSpreadsheet, AsyncioGspreadWorksheet,
 )
-from gspread.exceptions import SpreadsheetNotFound, WorksheetNotFound
-from gspread.utils import ValueInputOption
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import ValueInputOption, a1_range_to_grid_range
 from sqlalchemy.engine.row import Row as SaRow
 
 from .const import MsgType
-from .utils import determine_msg_type, make_short_user_info
+from .utils import BufferedFlusher, determine_msg_type, make_short_user_info
 
 if TYPE_CHECKING:
     from .bot import SupportBot
 
 
-CLIENT: AsyncioGspreadClient | None = None
-CLIENT_MANAGER: gspread_asyncio.AsyncioGspreadClientManager | None = None
+CLIENT_MANAGERS: dict[Path, gspread_asyncio.AsyncioGspreadClientManager] = {}  # by cred file
 COLUMN_NAMES = 'When, UTC', 'Type', 'Who', 'To whom', 'Text', 'Filename', 'Forward', 'Subject'
 LAST_COLUMN_SHEET_LETTER = string.ascii_uppercase[len(COLUMN_NAMES) - 1]
+FLUSH_DELAY = 3  # seconds a row waits for others to be spooled and appended together
+FLUSH_ROWS = 50  # buffered rows which are spooled and appended right away
+RETRY_DELAY = 30  # seconds before writing rows again after a failure
+SPOOL_BATCH_SIZE = 500  # rows appended with one request when draining the spool
 
 
-async def _get_client(bot: 'SupportBot') -> AsyncioGspreadClient:
+@functools.cache
+def _load_credentials(cred_file: Path) -> Credentials:
     """
-    gspread_asyncio docs require to do it this way
+    Read a service account file once. gspread_asyncio calls it in a thread
+    on every reauthorization, so it doesn't block the event loop.
     """
-    global CLIENT, CLIENT_MANAGER
+    creds = Credentials.from_service_account_file(cred_file)
+    scoped = creds.with_scopes([
+        "https://spreadsheets.google.com/feeds",
+        "https://www.googleapis.com/auth/spreadsheets",
+        "https://www.googleapis.com/auth/drive",
+    ])
+    return scoped
+
 
-    if not CLIENT_MANAGER:
+async def _get_client(bot: 'SupportBot') -> AsyncioGspreadClient:
+    """
+    A client of the bot's Google account. Bots with different credentials files
+    have their own clients, which don't wait for each other's requests.
+    The manager authorizes the client again when its token is about to expire.
+    """
+    cred_file = bot.cfg.save_messages_gsheets_cred_file
+    if not (manager := CLIENT_MANAGERS.get(cred_file)):
         await bot.log('Create Asyncio Gspread Client Manager')
-        CLIENT_MANAGER = gspread_asyncio.AsyncioGspreadClientManager(bot.get_gsheets_creds)
-    if not CLIENT:
-        await bot.log('Create Asyncio Gspread Client')
-        CLIENT = await CLIENT_MANAGER.authorize()
-    return CLIENT
+        manager = gspread_asyncio.AsyncioGspreadClientManager(
+            functools.partial(_load_credentials, cred_file))
+        CLIENT_MANAGERS[cred_file] = manager
+    return await manager.authorize()
 
 
 def _to_gsheet_text(obj: Any) -> str:
@@ -80,12 +103,18 @@ def _msg_to_row_data(msg: agtypes.Message) -> dict:
             'subject': ''}
 
 
-async def _ensure_worksheet(doc: AsyncioGspreadSpreadsheet) -> AsyncioGspreadWorksheet:
+def _worksheet_name(when: datetime | None = None) -> str:
+    """
+    Messages are saved to a worksheet per month
+    """
+    when = when or datetime.utcnow()
+    return f'{when.year}-{when.month}'
+
+
+async def _ensure_worksheet(doc: AsyncioGspreadSpreadsheet, name: str) -> AsyncioGspreadWorksheet:
     """
     Get or reate a worksheet with correct columns
     """
-    now = datetime.utcnow()
-    name = f'{now.year}-{now.month}'
     try:
         sheet = await doc.worksheet(name)
     except WorksheetNotFound:
@@ -103,71 +132,161 @@ async def _ensure_worksheet(doc: AsyncioGspreadSpreadsheet) -> AsyncioGspreadWor
     return sheet
 
 
-async def _gsheets_connect(
-        msg: agtypes.Message) -> tuple[AsyncioGspreadWorksheet, dict, int] | None:
+def _row_values(rd: dict) -> list[str]:
     """
-    Prepare everything to insert a row:
-    autheticate, ensure spreadsheet, ensure worksheet,
-    calculate a place to insert, construct row fields
+    Row fields in the order of COLUMN_NAMES
     """
-    bot = msg.bot
-    client = await _get_client(bot)
-
-    gsheets_filename = bot.cfg.save_messages_gsheets_filename
-    await bot.log(f'Saving message to Google Sheet "{gsheets_filename}"')
-
-    try:  # open spreadsheet document
-        doc = await client.open(gsheets_filename)
-    except SpreadsheetNotFound as exc:
-        await bot.log_error(exc)
-        return
-
-    sheet = await _ensure_worksheet(doc)
-    row_data = _msg_to_row_data(msg)
-    index = len(await sheet.col_values(1)) + 1
-    return sheet, row_data, index
+    return [rd['when'], rd['type'], rd['who'], rd['to_whom'], rd['text'], rd['filename'],
+            rd['forward'], rd['subject']]
 
 
-async def _insert_row(sheet: AsyncioGspreadWorksheet, rd: dict, index: int) -> None:
+class GsheetsWriter:
     """
-    Insert row field in right order into provided worksheet
+    Appends rows of a bot's messages to the spreadsheet in the background.
+    Rows are buffered in memory, and saved to the spool table in the bot's DB
+    with one executemany, so handlers don't wait for Google, and rows survive
+    its outages and restarts. The buffer is spooled, and the spool drained
+    with one append_rows call and at most one batch_format for highlighting
+    per batch and worksheet, FLUSH_DELAY seconds after a row is added, or as
+    soon as FLUSH_ROWS are. Shipped rows are deleted from the spool after each
+    batch; after a failure, the rest is retried after RETRY_DELAY.
+    A row is appended to the worksheet of the month its message was sent in.
+
+    The opened spreadsheet and the last worksheet are kept between flushes,
+    and opened again for another month or after a failed write.
     """
-    row = (rd['when'], rd['type'], rd['who'], rd['to_whom'], rd['text'], rd['filename'],
-           rd['forward'], rd['subject'])
-    await sheet.insert_row(row, index=index, value_input_option=ValueInputOption.user_entered)
+    def __init__(self, bot: 'SupportBot'):
+        self.bot = bot
+        self._buffer: list[dict] = []
+        self._spool_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._flusher = BufferedFlusher(self.flush, self._flush_failed, FLUSH_ROWS, FLUSH_DELAY)
+        self._doc: AsyncioGspreadSpreadsheet | None = None
+        self._sheet: AsyncioGspreadWorksheet | None = None
+
+    @property
+    def enabled(self) -> bool:
+        cfg = self.bot.cfg
+        return bool(cfg.save_messages_gsheets_cred_file and cfg.save_messages_gsheets_filename)
+
+    def start(self) -> None:
+        """
+        Ship rows left in the spool by the previous run
+        """
+        if self.enabled:
+            self._flusher.flush_soon()
+
+    def add(self, row_data: dict, sent_at: datetime, highlight: bool = False) -> None:
+        self._buffer.append({'cells': _row_values(row_data), 'highlight': highlight,
+                             'worksheet': _worksheet_name(sent_at)})
+
+        self._flusher.added(len(self._buffer))
+
+    async def _flush_failed(self, exc: Exception) -> None:
+        await self.bot.log_error(exc)
+        self._flusher.schedule(RETRY_DELAY)  # rows stay spooled
+
+    async def spool(self) -> None:
+        """
+        Save the buffered rows to the spool table, with one executemany
+        """
+        async with self._spool_lock:
+            if not self._buffer:
+                return
+            rows, self._buffer = self._buffer, []
+            try:
+                await self.bot.db.gsheets_spool.add_many(rows)
+            except Exception:
+                self._buffer[:0] = rows
+                raise
+
+    async def flush(self) -> None:
+        """
+        Spool the buffer, and append the spooled rows to their months'
+        worksheets, batch by batch
+        """
+        async with self._flush_lock:
+            self._flusher.cancel_timer()
+            await self.spool()
+            while rows := await self.bot.db.gsheets_spool.get_first(SPOOL_BATCH_SIZE):
+                for name, group in itertools.groupby(
+                        rows, key=lambda row: row.worksheet or _worksheet_name()):
+                    group = list(group)
+                    await self._write(name, [(row.cells, row.highlight) for row in group])
+                    await self.bot.db.gsheets_spool.remove_up_to(group[-1].id)
+                if len(rows) < SPOOL_BATCH_SIZE:
+                    break
+
+    async def _get_worksheet(self, name: str) -> AsyncioGspreadWorksheet:
+        """
+        The month's worksheet, opened only if it isn't cached yet
+        """
+        bot = self.bot
+        if self._sheet and self._sheet.title == name:
+            return self._sheet
+
+        if not self._doc:
+            client = await _get_client(bot)
+            gsheets_filename = bot.cfg.save_messages_gsheets_filename
+            await bot.log(f'Opening Google Sheet "{gsheets_filename}"')
+            self._doc = await client.open(gsheets_filename)  # rows wait in the spool if it fails
+
+        self._sheet = await _ensure_worksheet(self._doc, name)
+        return self._sheet
+
+    async def _write(self, name: str, queued: list[tuple[list[str], bool]]) -> None:
+        await self.bot.log(f'Saving {len(queued)} messages to Google Sheets')
+        try:
+            sheet = await self._get_worksheet(name)
+            result = await sheet.append_rows(
+                [row for row, _ in queued], value_input_option=ValueInputOption.user_entered,
+                insert_data_option='INSERT_ROWS', table_range='A1',
+            )
+        except Exception:  # the document may have been deleted or renamed, open it again
+            self._doc = self._sheet = None
+            raise
+
+        if any(highlight for _, highlight in queued):
+            updated_range = result['updates']['updatedRange'].split('!')[-1]
+            first_row = a1_range_to_grid_range(updated_range)['startRowIndex'] + 1
+            ranges = [f'A{first_row + i}:D{first_row + i}'
+                      for i, (_, highlight) in enumerate(queued) if highlight]
+            try:  # the rows are saved already, don't let them be queued again
+                await format_cells(sheet, ranges, ('bold',))
+            except Exception as exc:
+                await self.bot.log_error(exc)
 
 
 async def gsheets_save_admin_message(msg: agtypes.Message, tguser: SaRow) -> None:
     """
-    Save a message written by Admin in Google Sheets
+    Queue a message written by Admin to be saved in Google Sheets
     """
-    sheet, row_data, index = await _gsheets_connect(msg)
+    row_data = _msg_to_row_data(msg)
     row_data['to_whom'] = _to_gsheet_text(make_short_user_info(tguser=tguser))
-    await _insert_row(sheet, row_data, index)
+    msg.bot.gsheets.add(row_data, msg.date)
 
 
 async def gsheets_save_user_message(msg: agtypes.Message, highlight: bool=False) -> None:
     """
-    Save a message written by User in Google Sheets
+    Queue a message written by User to be saved in Google Sheets
     """
-    sheet, row_data, index = await _gsheets_connect(msg)
+    row_data = _msg_to_row_data(msg)
 
     botname = msg.bot.name.lower()
     to_whom = botname if botname.endswith('bot') else f'{botname} bot'
     row_data['to_whom'] = _to_gsheet_text(to_whom)
-    row_data['subject'] = (await msg.bot.db.tguser.get(user=msg.from_user)).subject
-    await _insert_row(sheet, row_data, index)
-
-    if highlight:
-        await format_cells(sheet, f"A{index}:D{index}", ('bold',))
+    tguser = await msg.bot.db.tguser.get(user=msg.from_user)
+    row_data['subject'] = tguser.subject if tguser else ''
+    msg.bot.gsheets.add(row_data, msg.date, highlight=highlight)
 
 
-async def format_cells(sheet: AsyncioGspreadWorksheet, ranje: str, modes: tuple[str, ...],
-                       switch: bool = True) -> None:
+async def format_cells(sheet: AsyncioGspreadWorksheet, ranje: str | list[str],
+                       modes: tuple[str, ...], switch: bool = True) -> None:
     """
-    Shortcut for basic cell format.
+    Shortcut for basic cell format, of one range or several ranges at once.
     Modes: bold, italic, underline etc.
     switch=False desables the chosen formatting mode.
     """
     modesdict = {m: switch for m in modes}
-    await sheet.batch_format([{"range": ranje, "format": {"textFormat": modesdict}}])
+    ranges = [ranje] if isinstance(ranje, str) else ranje
+    await sheet.batch_format([{"range": r, "format": {"textFormat": modesdict}} for r in ranges])
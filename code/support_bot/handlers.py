@@ -13,6 +13,9 @@ from sqlalchemy.engine.row import Row as SaRow
 from .admin_actions import (
     BroadcastForm, admin_broadcast_ask_confirm, admin_broadcast_cancel, admin_broadcast_finish,
 )
+from .admission import AdmissionMiddleware
+from .antiflood import AntifloodMiddleware
+from .archive import format_search_results
 from .buttons import (
     CBD, admin_btn_handler, build_ban_menu, send_new_msg_with_keyboard, user_btn_handler,
 )
@@ -36,7 +39,8 @@ async def cmd_start(msg: agtypes.Message, *args, **kwargs) -> None:
     Reply to /start
     """
     bot, user, db = msg.bot, msg.chat, msg.bot.db
-    sentmsg = await send_new_msg_with_keyboard(bot, user.id, bot.cfg.hello_msg, bot.menu)
+    menu = bot.menu.root if bot.menu else None
+    sentmsg = await send_new_msg_with_keyboard(bot, user.id, bot.cfg.hello_msg, menu)
 
     new_user = False
     async with bot.user_lock(user.id):
@@ -186,10 +190,14 @@ async def user_message(msg: agtypes.Message, *args, **kwargs) -> None:
     """
     Create or reuse the user's row and admin-group topic,
     then forward the user message there.
+    A new topic is saved to the user's row right away, so it's reused even if
+    the rest fails. All the other DB writes are committed in one transaction,
+    before the user lock is released, so a concurrent message sees
+    the up-to-date row.
     """
     bot, user, db = msg.bot, msg.chat, msg.bot.db
 
-    async with bot.user_lock(user.id):
+    async with bot.user_lock(user.id), db.unit_of_work() as uow:
         tguser = await db.tguser.get(user=user)
         if tguser and tguser.banned:
             return
@@ -203,19 +211,21 @@ async def user_message(msg: agtypes.Message, *args, **kwargs) -> None:
 
         if not thread_id:
             thread_id = await _new_topic(msg, tguser=tguser)
+            if tguser:
+                await db.tguser.update(user.id, thread_id=thread_id)
+            else:
+                tguser = await db.tguser.add(user, msg, thread_id)
             forwarded = await _preface_and_forward(msg, thread_id)
 
-        if (tguser is None or not tguser.first_replied) and bot.cfg.first_reply:
+        if not tguser.first_replied and bot.cfg.first_reply:
             sentmsg = await bot.send_message(user.id, bot.cfg.first_reply)
             await save_for_destruction(sentmsg, bot)
 
-        if tguser:
-            await db.tguser.update(user.id, user_msg=msg, thread_id=thread_id, first_replied=True)
-        else:
-            await db.tguser.add(user, msg, thread_id, first_replied=True)
+        await db.tguser.update(user.id, user_msg=msg, thread_id=thread_id, first_replied=True,
+                               reachable=True, uow=uow)
 
         if forwarded:
-            await db.msgmap.add(forwarded.message_id, user.id, msg.message_id)
+            await db.msgmap.add(forwarded.message_id, user.id, msg.message_id, uow=uow)
 
     await save_user_message(msg)
     await save_for_destruction(msg, bot)
@@ -279,6 +289,29 @@ async def cmd_del(msg: agtypes.Message, *args, **kwargs) -> None:
     await msg.reply('🗑 Deleted for the user')
 
 
+@log
+@handle_error
+async def cmd_search(msg: agtypes.Message, *args, **kwargs) -> None:
+    """
+    Admin writes /search with words in the General topic —
+    reply with the most relevant archived messages containing them
+    """
+    bot = msg.bot
+
+    if not await may_use_admin_actions(bot, msg.from_user):
+        await msg.reply('Only group admins can do this')
+        return
+    if not bot.archive.enabled:
+        await msg.reply('The message archive is off for this bot')
+        return
+    if not (text := kwargs['command'].args):
+        await msg.reply('Write the words to search after the command: /search refund order')
+        return
+
+    rows = await bot.archive.search(text)
+    await msg.reply(format_search_results(bot, text, rows), disable_web_page_preview=True)
+
+
 @log
 @handle_error
 async def user_edited_message(msg: agtypes.Message, *args, **kwargs) -> None:
@@ -390,7 +423,8 @@ async def reaction_changed(update: agtypes.MessageReactionUpdated, *args, **kwar
 @handle_error
 async def user_blocked_or_unblocked(update: agtypes.ChatMemberUpdated, *args, **kwargs) -> None:
     """
-    Report to the admin topic when the user blocks or unblocks the bot
+    Report to the admin topic when the user blocks or unblocks the bot,
+    and remember whether the user is reachable
     """
     bot = update.bot
     old, new = update.old_chat_member.status, update.new_chat_member.status
@@ -403,6 +437,7 @@ async def user_blocked_or_unblocked(update: agtypes.ChatMemberUpdated, *args, **
         return
 
     if tguser := await bot.db.tguser.get(user_id=update.from_user.id):
+        await bot.db.tguser.update(tguser.user_id, reachable=new == ChatMemberStatus.MEMBER)
         await bot.send_message(bot.cfg.admin_group_id, text,
                                message_thread_id=tguser.thread_id)
 
@@ -419,17 +454,21 @@ async def mention_in_admin_group(msg: agtypes.Message, *args, **kwargs) -> None:
         await msg.reply('Only group admins can do this')
         return
 
-    await send_new_msg_with_keyboard(bot, group.id, 'Choose:', bot.admin_menu)
+    await send_new_msg_with_keyboard(bot, group.id, 'Choose:', bot.admin_menu.root)
 
 
 def register_handlers(dp: Dispatcher) -> None:
     """
     Register all the handlers to the provided dispatcher
     """
+    dp.update.outer_middleware(AntifloodMiddleware())  # before flood takes admission slots
+    dp.update.outer_middleware(AdmissionMiddleware())
+
     dp.message.register(user_message, PrivateChatFilter(), ~ACommandFilter())
     dp.message.register(admin_message, ~ACommandFilter(), AdminMessageForUser())
     dp.message.register(cmd_start, PrivateChatFilter(), Command('start'))
     dp.message.register(cmd_del, Command('del'), InAdminGroupTopic())
+    dp.message.register(cmd_search, Command('search'), InAdminGroup())
 
     dp.edited_message.register(user_edited_message, PrivateChatFilter(), ~ACommandFilter())
     dp.edited_message.register(admin_edited_message, ~ACommandFilter(), AdminMessageForUser())
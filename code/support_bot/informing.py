@@ -12,6 +12,7 @@ from sqlalchemy.engine.row import Row as SaRow
 
 from .const import ActionName
 from .gsheets import gsheets_save_admin_message, gsheets_save_user_message
+from .ratelimit import bulk_lane
 from .utils import make_short_user_info
 
 if TYPE_CHECKING:
@@ -54,12 +55,16 @@ def handle_error(func: Callable) -> Callable:
 @log
 async def report_user_ban(msg: agtypes.Message, func: Callable) -> None:
     """
-    Report when the user banned the bot
+    Report when the user banned the bot, and mark the user unreachable
     """
     bot = msg.bot
     thread_id = getattr(msg, 'message_thread_id', None)
 
-    if func.__name__ == 'admin_message' and await bot.db.tguser.get(thread_id=thread_id):
+    if func.__name__ != 'admin_message':
+        return
+
+    if tguser := await bot.db.tguser.get(thread_id=thread_id):
+        await bot.db.tguser.update(tguser.user_id, reachable=False)
         group_id = bot.cfg.admin_group_id
         await bot.send_message(
             group_id, 'The user banned the bot', message_thread_id=thread_id,
@@ -83,13 +88,16 @@ async def report_cant_create_topic(msg: agtypes.Message) -> None:
 
 async def save_admin_message(msg: agtypes.Message, tguser: SaRow) -> None:
     """
-    Entrypoint for all the mechanisms of saving messages sent by admin.
-    There is only one currently: Google Sheets.
+    Entrypoint for all the mechanisms of saving messages sent by admin:
+    Google Sheets and the local archive.
     """
-    gsheets_cred_file = msg.bot.cfg.save_messages_gsheets_cred_file
-    gsheets_filename = msg.bot.cfg.save_messages_gsheets_filename
-    if gsheets_cred_file and gsheets_filename:
+    bot = msg.bot
+
+    if bot.gsheets.enabled:
         await gsheets_save_admin_message(msg, tguser)
+    if bot.archive.enabled:
+        bot.archive.add(msg, make_short_user_info(tguser=tguser, escape=False), tguser.subject,
+                        tguser.thread_id)
 
 
 async def save_user_message(
@@ -98,15 +106,16 @@ async def save_user_message(
         stat: bool = True,
     ) -> None:
     """
-    Entrypoint for all the mechanisms of saving messages sent by user.
-    There is only one currently: Google Sheets.
+    Entrypoint for all the mechanisms of saving messages sent by user:
+    Google Sheets and the local archive.
     """
     bot = msg.bot
 
-    gsheets_cred_file = bot.cfg.save_messages_gsheets_cred_file
-    gsheets_filename = bot.cfg.save_messages_gsheets_filename
-    if gsheets_cred_file and gsheets_filename:
+    if bot.gsheets.enabled:
         await gsheets_save_user_message(msg, highlight=new_user)
+    if bot.archive.enabled:
+        tguser = await bot.db.tguser.get(user=msg.from_user)
+        bot.archive.add(msg, bot.name, tguser and tguser.subject, tguser and tguser.thread_id)
 
     if stat:
         await bot.db.action.add(ActionName.user_message)
@@ -136,6 +145,8 @@ async def _report_stats(bot: 'SupportBot') -> None:
     msg += '\n#stats'
     await bot.send_message(bot.cfg.admin_group_id, msg)
 
+    await bot.log(f'Users cache: {bot.db.tguser.cache.info()}')
+
 
 async def stats_to_admin_chat(bots: list['SupportBot']) -> None:
     """
@@ -144,6 +155,7 @@ async def stats_to_admin_chat(bots: list['SupportBot']) -> None:
     """
     for bot in bots:
         try:
-            await _report_stats(bot)
+            with bulk_lane():
+                await _report_stats(bot)
         except Exception as exc:
             await bot.log_error(exc)
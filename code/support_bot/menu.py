@@ -0,0 +1,153 @@
+"""
+Bot menus compiled from menu.toml (or a dict) into a tree of immutable nodes
+"""
+import zlib
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import MappingProxyType
+
+import toml
+
+from .const import MSG_TEXT_LIMIT, ButtonMode, MenuMode
+
+
+ROW_WIDTH = 8  # buttons in a row of a menu with menumode = "row"
+
+
+def load_toml(path: Path) -> dict | None:
+    """
+    Read toml file
+    """
+    if path.is_file():
+        with open(path) as f:
+            menu = toml.load(f)
+        _validate_menu_modes(menu)
+        return menu
+
+
+def _validate_menu_modes(menu: dict) -> None:
+    """
+    Recursively check any 'menumode' entries against MenuMode at startup,
+    so typos like menumode = "rows" fail loudly instead of silently falling
+    back to the default layout.
+    """
+    for key, val in menu.items():
+        if key == 'menumode':
+            MenuMode.validate(val, raise_exc=True)
+        elif isinstance(val, dict):
+            _validate_menu_modes(val)
+
+
+def _recognize_mode(content: dict) -> ButtonMode:
+    if 'link' in content:
+        return ButtonMode.LINK
+    elif 'file' in content:
+        return ButtonMode.FILE
+    elif any(isinstance(v, dict) and 'label' in v for v in content.values()):
+        return ButtonMode.MENU
+    elif 'subject' in content:
+        return ButtonMode.SUBJECT
+    return ButtonMode.ANSWER  # label-only buttons act on press via their handler
+
+
+def _extract_answer(content: dict, mode: ButtonMode) -> str:
+    answer = (content.get('answer') or '')[:MSG_TEXT_LIMIT]
+    if mode == ButtonMode.SUBJECT:
+        answer = answer or f'Please write your question about "{content["label"]}"'
+    elif mode not in (ButtonMode.LINK, ButtonMode.FILE):
+        answer = answer or '👀'
+    return answer
+
+
+@dataclass(frozen=True, eq=False)
+class MenuNode:
+    """
+    A menu button with everything its press needs, computed once.
+    The root node is the menu itself: no label, the empty key and path.
+    """
+    path: str  # id of the parent node
+    key: str
+    num: int | None  # short stable number to refer to the node in callback data, if numbered
+    label: str
+    mode: ButtonMode
+    answer: str
+    link: str | None = None
+    file: str | None = None
+    subject: str | None = None
+    children: tuple['MenuNode', ...] = field(default=(), repr=False)
+    layout: tuple[tuple['MenuNode', ...], ...] = field(default=(), repr=False)  # button rows
+    parent: 'MenuNode | None' = field(default=None, repr=False)
+
+    @property
+    def id(self) -> str:
+        return f'{self.path}.{self.key}' if self.path else self.key
+
+
+class Menu:
+    """
+    A menu tree compiled from a menu dict, where nodes are found by id
+    (the keys from the root joined by '.') with a dict lookup.
+    Nodes of a numbered menu also get a number, the same while the node's id
+    is the same, even after the menu is edited. So callback data can refer
+    to a node of any depth in a few bytes.
+    """
+    def __init__(self, content: dict, answer: str | None = None, numbered: bool = False):
+        self._nodes: dict[str, MenuNode] = {}
+        self._by_num: dict[int, MenuNode] = {}
+        self._numbered = numbered
+        self.root = self._compile(content, '', '', None, answer)
+        self._nodes = MappingProxyType(self._nodes)
+        self._by_num = MappingProxyType(self._by_num)
+
+    def _number(self, node_id: str) -> int | None:
+        """
+        CRC32 of the node id, rehashed with a salt on a collision
+        """
+        if not self._numbered:
+            return None
+        num, salt = zlib.crc32(node_id.encode()), 0
+        while num in self._by_num:
+            salt += 1
+            num = zlib.crc32(f'{node_id}#{salt}'.encode())
+        return num
+
+    def _compile(self, content: dict, path: str, key: str, parent: MenuNode | None,
+                 answer: str | None = None) -> MenuNode:
+        mode = ButtonMode.MENU if parent is None else _recognize_mode(content)
+        node_id = f'{path}.{key}' if path else key
+        node = MenuNode(
+            path=path, key=key, num=self._number(node_id), label=content.get('label', ''),
+            mode=mode, answer=answer or _extract_answer(content, mode),
+            link=content.get('link'), file=content.get('file'), subject=content.get('subject'),
+            parent=parent,
+        )
+        self._nodes[node.id] = node
+        if node.num is not None:
+            self._by_num[node.num] = node
+
+        children = tuple(
+            self._compile(val, node.id, str(k), node)
+            for k, val in content.items() if isinstance(val, dict) and 'label' in val
+        )
+        if content.get('menumode') == MenuMode.ROW:
+            layout = tuple(children[i:i + ROW_WIDTH] for i in range(0, len(children), ROW_WIDTH))
+        else:
+            layout = tuple((child,) for child in children)
+
+        # set after creation, since the children refer to the node
+        object.__setattr__(node, 'children', children)
+        object.__setattr__(node, 'layout', layout)
+        return node
+
+    def __iter__(self) -> Iterator[MenuNode]:
+        return iter(self._nodes.values())
+
+    def __getitem__(self, node_id: str) -> MenuNode:
+        return self._nodes[node_id]
+
+    def find(self, path: str, key: str) -> MenuNode | None:
+        return self._nodes.get(f'{path}.{key}' if path else key)
+
+    def by_num(self, num: int) -> MenuNode | None:
+        return self._by_num.get(num)
@@ -0,0 +1,150 @@
+"""
+Rate limiting of outgoing Telegram requests
+"""
+import asyncio
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware, NextRequestMiddlewareType,
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from .const import Lane
+
+
+GLOBAL_RATE = 30  # requests per second, Telegram's limit for a bot
+PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST = 1, 3  # per second, in a chat with a user
+GROUP_RATE, GROUP_BURST = 20 / 60, 20  # 20 messages per minute in a group, except the admin one
+BULK_RESERVE = 0.2  # share of a bucket the bulk lane leaves to interactive requests
+MAX_RETRIES = 2  # interactive requests are sent again after a RetryAfter this many times
+CHAT_BUCKETS_LIMIT = 10_000  # idle chat buckets are forgotten beyond it
+POSTING_METHODS = ('send', 'copy', 'forward')  # prefixes of methods limited per chat
+
+LANE: ContextVar[Lane] = ContextVar('outbound_lane', default=Lane.INTERACTIVE)
+
+
+@contextmanager
+def bulk_lane() -> Iterator[None]:
+    """
+    Send the requests made inside the block, including in tasks
+    created inside it, in the bulk lane
+    """
+    token = LANE.set(Lane.BULK)
+    try:
+        yield
+    finally:
+        LANE.reset(token)
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average, with bursts up to `capacity`.
+    The rate can be changed on the fly, and the bucket paused, e.g. on RetryAfter.
+    An acquisition with a reserve waits until the bucket has that many tokens
+    on top of the one it takes, so acquisitions without it go first.
+    """
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # waiters with the same reserve are served in FIFO order
+        self._locks: defaultdict[float, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self) -> bool:
+        """
+        Full and not paused, so it's the same as a new bucket
+        """
+        now = time.monotonic()
+        self._refill(max(now, self._updated))
+        return self._tokens >= self.capacity and now >= self._paused_until
+
+    async def acquire(self, reserve: float = 0) -> None:
+        async with self._locks[reserve]:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= 1 + reserve:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 + reserve - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop handing out tokens for this many seconds, and start empty after that
+        """
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Session middleware which spaces out a bot's requests to chats by token
+    buckets: one for the bot, like Telegram's global limit, and one per chat
+    for posting messages, with different limits for user chats and groups.
+    The admin group is only limited by the bot's bucket: all the support
+    traffic goes there, and Telegram limits it per topic, much looser.
+    Requests sent in the bulk lane (broadcasts, destruction, cleanup, reports)
+    leave a share of every bucket to interactive ones, like relaying messages.
+    On RetryAfter the buckets the request went through are paused, and
+    an interactive request is sent again after the pause.
+    """
+    def __init__(self):
+        self.bucket = TokenBucket(GLOBAL_RATE)
+        self._chat_buckets: dict[int | str, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        if (bucket := self._chat_buckets.get(chat_id)) is None:
+            if len(self._chat_buckets) >= CHAT_BUCKETS_LIMIT:
+                self._chat_buckets = {
+                    cid: b for cid, b in self._chat_buckets.items() if not b.idle}
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+            else:
+                bucket = TokenBucket(GROUP_RATE, GROUP_BURST)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None or method.__api_method__.startswith('get'):  # not sending anything
+            return await make_request(bot, method)
+
+        bulk = LANE.get() == Lane.BULK
+        buckets = [self.bucket]
+        if (method.__api_method__.startswith(POSTING_METHODS)
+                and chat_id != bot.cfg.admin_group_id):
+            buckets.insert(0, self._chat_bucket(chat_id))
+
+        retries = 0
+        while True:
+            for bucket in buckets:
+                await bucket.acquire(bucket.capacity * BULK_RESERVE if bulk else 0)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as exc:
+                for bucket in buckets:  # the chat's one, if any, and the bot's one
+                    bucket.pause(exc.retry_after)
+                if bulk or retries >= MAX_RETRIES:
+                    raise
+                retries += 1
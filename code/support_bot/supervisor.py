@@ -0,0 +1,102 @@
+"""
+Running the bots in several worker processes, restarted when they crash
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+
+RESTART_DELAY = 1  # seconds before restarting a crashed worker, doubled on each crash...
+MAX_RESTART_DELAY = 60  # ...up to this
+STABLE_AFTER = 60  # seconds of running after which a crash is not counted as a repeated one
+STOP_TIMEOUT = 10  # seconds for workers to shut down before they are killed
+LINE_LIMIT = 2 ** 20  # bytes in a line of a worker's output
+LOG_FORMAT = '%(levelname)s: %(message)s'  # of workers, timestamps are added by the supervisor
+
+
+def make_shards(names: list[str], workers: int) -> list[list[str]]:
+    """
+    Split the bot names into up to `workers` shards, round-robin
+    """
+    shards = [names[i::workers] for i in range(min(workers, len(names)))]
+    return [shard for shard in shards if shard]
+
+
+class Worker:
+    """
+    A process running `script` for a shard of the bots. Its output is read
+    line by line and logged by the supervisor's logger, with the level
+    parsed from the line, so all the workers log to one place.
+    """
+    def __init__(self, script: Path, num: int, names: list[str], logger: logging.Logger):
+        self.script = script
+        self.num = num
+        self.names = names
+        self.logger = logger
+        self.proc: asyncio.subprocess.Process | None = None
+
+    async def run_forever(self) -> None:
+        delay = RESTART_DELAY
+        while True:
+            started = time.monotonic()
+            try:
+                code = await self._run()
+            except Exception:  # failed to spawn, or a too long line of output
+                self.logger.exception('Worker %s (%s) failed', self.num, ', '.join(self.names))
+                await self.stop()
+                code = self.proc.returncode if self.proc else None
+            if time.monotonic() - started >= STABLE_AFTER:
+                delay = RESTART_DELAY
+            self.logger.error('Worker %s (%s) exited with code %s, restarting in %ss',
+                              self.num, ', '.join(self.names), code, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    async def _run(self) -> int:
+        self.proc = None
+        env = {**os.environ, 'BOTS_ENABLED': ','.join(self.names), 'MBSB_WORKER': str(self.num)}
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, str(self.script), env=env,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, limit=LINE_LIMIT,
+        )
+        self.logger.info('Worker %s started for %s, pid %s',
+                         self.num, ', '.join(self.names), self.proc.pid)
+        try:
+            level = logging.INFO
+            async for line in self.proc.stdout:
+                text = line.decode(errors='replace').rstrip()
+                prefix, sep, msg = text.partition(': ')
+                if sep and prefix in logging.getLevelNamesMapping():
+                    level, text = logging.getLevelNamesMapping()[prefix], msg
+                # lines without a level, like tracebacks, continue the previous record
+                self.logger.log(level, '[worker %s] %s', self.num, text)
+            return await self.proc.wait()
+        except asyncio.CancelledError:
+            await self.stop()
+            raise
+
+    async def stop(self) -> None:
+        if self.proc is None or self.proc.returncode is not None:
+            return
+        self.proc.terminate()
+        try:
+            await asyncio.wait_for(self.proc.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.proc.kill()
+            await self.proc.wait()
+
+
+async def supervise(script: Path, names: list[str], workers: int,
+                    logger: logging.Logger) -> None:
+    """
+    Run the bots sharded across worker processes until cancelled,
+    restarting the workers which exit
+    """
+    shards = make_shards(names, workers)
+    logger.info('Running %s bots in %s workers', len(names), len(shards))
+    await asyncio.gather(*(
+        Worker(script, num, shard, logger).run_forever() for num, shard in enumerate(shards)
+    ))
@@ -1,10 +1,10 @@
-import datetime
+import asyncio
 import html
+from collections.abc import Awaitable, Callable
 from typing import TYPE_CHECKING
 
 import aiogram.types as agtypes
 from aiogram.enums import ChatMemberStatus
-from aiogram.exceptions import TelegramBadRequest
 from sqlalchemy.engine.row import Row as SaRow
 
 from .const import ANONYMOUS_ADMIN_ID, MsgType
@@ -55,9 +55,10 @@ async def make_user_info(user: agtypes.User, bot: 'SupportBot | None' = None,
     return '\n\n'.join(fields)
 
 
-def make_short_user_info(user: agtypes.User | None = None, tguser: SaRow | None = None) -> str:
+def make_short_user_info(user: agtypes.User | None = None, tguser: SaRow | None = None,
+                         escape: bool = True) -> str:
     """
-    Short text representation of a user
+    Short text representation of a user, HTML-escaped unless escape=False
     """
     if user:
         user_id = user.id
@@ -65,7 +66,9 @@ def make_short_user_info(user: agtypes.User | None = None, tguser: SaRow | None
         user_id = tguser.user_id
         user = tguser
 
-    fullname = html.escape(user.full_name or '')
+    fullname = user.full_name or ''
+    if escape:
+        fullname = html.escape(fullname)
     tech_part = f'@{user.username}, id {user_id}' if user.username else f'id {user_id}'
     return f'{fullname} ({tech_part})'
 
@@ -104,59 +107,35 @@ def determine_msg_type(msg: agtypes.Message) -> MsgType:
         return MsgType.REGULAR_OR_OTHER
 
 
-async def destruct_messages(bots: list['SupportBot']) -> None:
+async def sweep_user_locks(bots: list['SupportBot']) -> None:
     """
-    Delete messages for users, if a bot is set up to do so.
-    A message leaves the queue when it's deleted, when Telegram rejects
-    the deletion as impossible (too old, already deleted), or when it's
-    past Telegram's 48-hour deletion window anyway. A message which failed
-    for any other reason stays queued and is retried on the next run.
+    Drop unheld per-user locks of every bot.
+    Async so the scheduler runs it on the event loop rather than in a thread.
     """
     for bot in bots:
-        destructed = 0
-        undeletable = 0
-
-        for var in 'destruct_user_messages_for_user', 'destruct_bot_messages_for_user':
-            if val := getattr(bot.cfg, var):
-                error_reported = False
-                by_bot = var == 'destruct_bot_messages_for_user'
-                now = datetime.datetime.utcnow()
-                before = now - datetime.timedelta(hours=val)
-                deadline = now - datetime.timedelta(hours=48)
-                msgs = await bot.db.msgtodel.get_many(before, by_bot)
-
-                to_remove = []
-                for msg in msgs:
-                    try:
-                        await bot.delete_message(msg.chat_id, msg.msg_id)
-                        destructed += 1
-                        to_remove.append(msg)
-                    except TelegramBadRequest:
-                        undeletable += 1
-                        to_remove.append(msg)
-                    except Exception as exc:
-                        if msg.sent_at <= deadline:
-                            undeletable += 1
-                            to_remove.append(msg)
-                        if not error_reported:
-                            await bot.log_error(exc)
-                        error_reported = True
-
-                await bot.db.msgtodel.remove(to_remove)
-
-        if destructed:
-            await bot.log(f'Messages destructed: {destructed}')
-        if undeletable:
-            await bot.log(f'Messages impossible to delete, dropped from the queue: {undeletable}')
+        bot.sweep_user_locks()
 
 
-async def sweep_user_locks(bots: list['SupportBot']) -> None:
+async def reload_menus(bots: list['SupportBot']) -> None:
     """
-    Drop unheld per-user locks of every bot.
-    Async so the scheduler runs it on the event loop rather than in a thread.
+    Reload the menus whose menu.toml has changed
     """
     for bot in bots:
-        bot.sweep_user_locks()
+        await bot.reload_menu()
+
+
+async def flush_db_buffers(bots: list['SupportBot']) -> None:
+    """
+    Write the data each bot's DB, message archive and Google Sheets writer
+    keep in memory, isolating each bot so one failure doesn't stop the others
+    """
+    for bot in bots:
+        try:
+            await bot.db.flush()
+            await bot.archive.flush()
+            await bot.gsheets.spool()
+        except Exception as exc:
+            await bot.log_error(exc)
 
 
 async def save_for_destruction(msg: agtypes.Message | agtypes.MessageId | None, bot: 'SupportBot',
@@ -178,3 +157,56 @@ async def save_for_destruction(msg: agtypes.Message | agtypes.MessageId | None,
 
     if getattr(bot.cfg, var):
         await bot.db.msgtodel.add(msg)
+
+
+class BufferedFlusher:
+    """
+    Runs a writer's `flush` of its in-memory buffer in the background:
+    as soon as the buffer has `max_rows` rows, or `delay` seconds after
+    the first buffered row. A failed flush is passed to `on_error`; its rows
+    stay buffered, so the next flush retries them.
+    """
+    def __init__(self, flush: Callable[[], Awaitable[None]],
+                 on_error: Callable[[Exception], Awaitable[None]], max_rows: int, delay: float):
+        self.flush = flush
+        self.on_error = on_error
+        self.max_rows = max_rows
+        self.delay = delay
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def added(self, buffered: int) -> None:
+        """
+        Called after a row is added to the buffer, with the buffer length
+        """
+        if buffered >= self.max_rows:
+            self.flush_soon()
+        else:
+            self.schedule(self.delay)
+
+    def schedule(self, delay: float) -> None:
+        """
+        Flush in `delay` seconds, unless a flush is already scheduled
+        """
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self.flush_soon)
+
+    def flush_soon(self) -> None:
+        self.cancel_timer()
+        task = asyncio.create_task(self._flush_in_background())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def cancel_timer(self) -> None:
+        """
+        Called by the writer's `flush`, which writes the buffer anyway
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def _flush_in_background(self) -> None:
+        try:
+            await self.flush()
+        except Exception as exc:
+            await self.on_error(exc)
@@ -0,0 +1,113 @@
+"""
+Receiving updates of all the bots by webhooks, with one aiohttp server
+"""
+import asyncio
+import hashlib
+import hmac
+import secrets
+from typing import TYPE_CHECKING
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import BaseRequestHandler, setup_application
+from aiohttp import web
+
+if TYPE_CHECKING:
+    from .bot import SupportBot
+
+
+PATH_PREFIX = '/webhook/'
+
+
+def _derive_secret(bot: Bot, purpose: str) -> str:
+    """
+    A secret derived from the bot token, so it stays the same
+    across restarts without configuring it
+    """
+    return hmac.new(bot.token.encode(), purpose.encode(), hashlib.sha256).hexdigest()
+
+
+def webhook_path(bot: Bot) -> str:
+    return PATH_PREFIX + _derive_secret(bot, 'webhook path')
+
+
+class BotsRequestHandler(BaseRequestHandler):
+    """
+    Feeds updates to the dispatcher, with the bot found by the secret path
+    of its webhook, and checked by the secret token Telegram sends.
+    A request is answered once its update is handed to a background task,
+    and no more than `concurrency` updates of a bot are handled at once:
+    the bot's requests beyond that wait for a free slot before being answered.
+    """
+    def __init__(self, dispatcher: Dispatcher, bots: list['SupportBot'], concurrency: int,
+                 **data):
+        super().__init__(dispatcher, bots=bots, **data)
+        self.bots = {webhook_path(bot): bot for bot in bots}
+        self._semaphores = {bot: asyncio.Semaphore(concurrency) for bot in bots}
+        self._tasks: set[asyncio.Task] = set()
+
+    def register(self, app: web.Application, /, path: str = PATH_PREFIX + '{secret}',
+                 **kwargs) -> None:
+        super().register(app, path=path, **kwargs)
+
+    async def close(self) -> None:
+        await asyncio.gather(*self._tasks, return_exceptions=True)  # let them finish
+        for bot in self.bots.values():
+            await bot.session.close()
+
+    async def resolve_bot(self, request: web.Request) -> Bot:
+        if (bot := self.bots.get(request.path)) is None:
+            raise web.HTTPNotFound()
+        return bot
+
+    def verify_secret(self, telegram_secret_token: str, bot: Bot) -> bool:
+        return secrets.compare_digest(telegram_secret_token, _derive_secret(bot, 'secret token'))
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), bot):
+            return web.Response(body='Unauthorized', status=401)
+
+        update = await request.json(loads=bot.session.json_loads)
+        semaphore = self._semaphores[bot]
+        await semaphore.acquire()
+        task = asyncio.create_task(self.dispatcher.feed_raw_update(bot, update, **self.data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda _: semaphore.release())
+        return web.json_response({})
+
+    __call__ = handle
+
+
+async def set_webhooks(dp: Dispatcher, bots: list['SupportBot'], base_url: str,
+                       concurrency: int) -> None:
+    """
+    Point the bots' webhooks to this server. Updates received while
+    the bots were down are kept, like in polling mode.
+    """
+    for bot in bots:
+        await bot.set_webhook(
+            base_url.rstrip('/') + webhook_path(bot),
+            secret_token=_derive_secret(bot, 'secret token'),
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=min(concurrency, 100),  # Telegram's maximum
+        )
+        await bot.log(f'Webhook is set to {base_url}')
+
+
+async def run_webhook_server(dp: Dispatcher, bots: list['SupportBot'], host: str, port: int,
+                             concurrency: int) -> None:
+    """
+    Serve the bots' webhooks until cancelled
+    """
+    app = web.Application()
+    BotsRequestHandler(dp, bots, concurrency).register(app)
+    setup_application(app, dp, bots=bots)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()